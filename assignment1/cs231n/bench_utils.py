@@ -0,0 +1,83 @@
+"""
+Helpers shared by the benchmark scripts in the assignment1 directory
+(knn_benchmark.py, linear_benchmark.py and precision_benchmark.py): a wall
+clock timer, synthetic stand-ins for CIFAR-10 and the CIFAR-10 loading and
+feature extraction they run on when the dataset has been downloaded.
+"""
+from __future__ import print_function
+
+import os
+import time
+
+import numpy as np
+
+
+CIFAR10_DIR = 'cs231n/datasets/cifar-10-batches-py'
+
+
+def timeit(fn, *args, **kwargs):
+  """
+  Call fn(*args, **kwargs) and return a tuple (out, seconds) of its result
+  and the wall clock time it took.
+  """
+  tic = time.time()
+  out = fn(*args, **kwargs)
+  return out, time.time() - tic
+
+
+def clustered_data(num_points, dim, num_clusters=10, spread=3.0, bias=False,
+                   seed=0):
+  """
+  Gaussian blobs with labels; a stand-in for CIFAR-10 that does not need the
+  dataset on disk.
+
+  Inputs:
+  - num_points: Number of rows to draw.
+  - dim: Dimension of the rows.
+  - num_clusters: Number of blobs, one per label.
+  - spread: Standard deviation of the blob centers; the points have unit
+    variance around their center, so small values give overlapping blobs.
+  - bias: Whether to append a column of ones.
+  - seed: Seed for the centers, labels and points.
+
+  Returns a tuple (X, y) of the points and their labels.
+  """
+  rng = np.random.RandomState(seed)
+  centers = spread * rng.randn(num_clusters, dim)
+  y = rng.randint(num_clusters, size=num_points)
+  X = centers[y] + rng.randn(num_points, dim)
+  if bias:
+    X = add_bias(X)
+  return X, y
+
+
+def add_bias(X):
+  """ X with a column of ones appended. """
+  return np.hstack([X, np.ones((X.shape[0], 1), dtype=X.dtype)])
+
+
+def load_cifar10(dtype=np.float64):
+  """
+  The CIFAR-10 images as returned by cs231n.data_utils.load_CIFAR10, or None
+  when the dataset has not been downloaded to cs231n/datasets.
+  """
+  if not os.path.isdir(CIFAR10_DIR):
+    return None
+  from cs231n.data_utils import load_CIFAR10
+  return load_CIFAR10(CIFAR10_DIR, dtype)
+
+
+def cifar_features(images_train, images_test, nbin=10):
+  """
+  HOG + color histogram features of two sets of CIFAR-10 images, normalized
+  with the mean and standard deviation of the first set.
+
+  Returns a tuple (F_train, F_test).
+  """
+  from cs231n.features import (extract_features, hog_feature,
+                               color_histogram_hsv)
+  feature_fns = [hog_feature, lambda img: color_histogram_hsv(img, nbin=nbin)]
+  F_train = extract_features(images_train, feature_fns)
+  F_test = extract_features(images_test, feature_fns)
+  mean, std = F_train.mean(axis=0), F_train.std(axis=0) + 1e-8
+  return (F_train - mean) / std, (F_test - mean) / std
@@ -1,28 +1,267 @@
+import mmap
+import os
+import time
+import weakref
+
 import numpy as np
 from past.builtins import xrange
+from cs231n.knn_index import (HNSWIndex, LSHIndex, PQIndex, build_tree,
+                               kmeans, l1_distances, merge_topk, sort_topk)
+from cs231n.parallel import (attach_arrays, release_arrays, resolve_n_jobs,
+                             share_arrays, spawn_pool)
+
+
+METRICS = ('l2', 'l1', 'cosine')
 
 
 class KNearestNeighbor(object):
-  """ a kNN classifier with L2 distance """
+  """ a kNN classifier with L2 (or L1 / cosine) distance """
 
-  def __init__(self):
-    pass
+  def __init__(self, memory_budget=64 * 1024 ** 2, block_size=512,
+               metric='l2'):
+    """
+    Inputs:
+    - memory_budget: Approximate number of bytes the blocked distance engine
+      may use for a single query x train tile, including the candidate arrays
+      used to merge the running top-k and the block of training rows the
+      tile is computed from. The query set and the running top-k of all
+      queries come on top of it.
+    - block_size: Maximum number of test points processed per tile.
+    - metric: Distance used by the blocked engine: 'l2', 'l1' or 'cosine'
+      (one minus the cosine similarity). The loop based paths, the partial
+      distance search and the indexes only support 'l2'.
+    """
+    if metric not in METRICS:
+      raise ValueError('Invalid metric "%s"' % metric)
+    self.memory_budget = memory_budget
+    self.block_size = block_size
+    self.metric = metric
 
-  def train(self, X, y):
+  def train(self, X, y, index=None, keep_data=True):
     """
     Train the classifier. For k-nearest neighbors this is just 
     memorizing the training data.
 
     Inputs:
     - X: A numpy array of shape (num_train, D) containing the training data
-      consisting of num_train samples each of dimension D.
+      consisting of num_train samples each of dimension D. X can also be the
+      path of an .npy file or an np.memmap (e.g. from np.load with
+      mmap_mode='r'); the distance engine then streams it from disk in
+      sequential blocks, so the training set does not have to fit in RAM,
+      and parallel predict workers map the same file instead of getting a
+      copy.
     - y: A numpy array of shape (N,) containing the training labels, where
          y[i] is the label for X[i].
+    - index: Optional name (or list of names) of search indexes to build over
+      the training data; see build_index.
+    - keep_data: If false, drop the reference to X once the indexes are
+      built, so that only compressed indexes such as 'pq' hold the training
+      set. predict then has to be called with an index.
     """
+    self._release_shared()
+    if isinstance(X, str):
+      X = np.load(X, mmap_mode='r')
+    self.train_path, self._train_map = None, None
+    # The layout of a memory mapped file lets the predict workers map it
+    # again. A view into a mapping (e.g. a slice) does not record where it
+    # starts in the file, so only whole mappings qualify.
+    if isinstance(X, np.memmap) and isinstance(X.base, mmap.mmap):
+      self.train_path = X.filename
+      self._train_map = (X.filename, X.dtype.str, X.shape, X.offset,
+                         'F' if X.flags.f_contiguous and X.ndim > 1 else 'C')
     self.X_train = X
     self.y_train = y
-    
-  def predict(self, X, k=1, num_loops=0):
+    # Squared norms of the training rows are reused by every query tile. The
+    # same pass gathers the per dimension moments that give the order in
+    # which query_topk_partial visits the dimensions.
+    num_train, dim = X.shape
+    self.train_sq_norms = np.empty(num_train)
+    col_sum, col_sq_sum = np.zeros(dim), np.zeros(dim)
+    _, cols = self._tile_shape(1, num_train, 1)
+    for start in xrange(0, num_train, cols):
+      X_block = X[start:start + cols]
+      sq = X_block * X_block
+      self.train_sq_norms[start:start + cols] = np.sum(sq, axis=1)
+      col_sum += np.sum(X_block, axis=0, dtype=np.float64)
+      col_sq_sum += np.sum(sq, axis=0, dtype=np.float64)
+    mean = col_sum / max(num_train, 1)
+    self._pds_order = np.argsort(-(col_sq_sum / max(num_train, 1) - mean ** 2))
+    self.indexes = {}
+    if index is not None:
+      for name in ([index] if isinstance(index, str) else index):
+        self.build_index(name)
+    if not keep_data:
+      self.X_train = None
+      self.train_sq_norms = None
+
+  def build_index(self, name, **kwargs):
+    """
+    Build a search index over the training data so that predict can avoid a
+    brute force scan.
+
+    Inputs:
+    - name: Which index to build. 'tree' builds an exact KD-tree or ball tree
+      depending on the dimension of the data. 'lsh' builds an approximate
+      random projection LSH index, 'hnsw' an approximate proximity graph and
+      'pq' a product quantized copy of the training data.
+    - kwargs: Passed on to the index constructor, e.g. kind and leaf_size for
+      cs231n.knn_index.build_tree, num_tables and num_bits for LSHIndex, M,
+      ef_construction and ef_search for HNSWIndex or num_subspaces and rerank
+      for PQIndex.
+    """
+    if name == 'tree':
+      self.indexes[name] = build_tree(self.X_train, **kwargs)
+    elif name == 'lsh':
+      self.indexes[name] = LSHIndex(self.X_train, **kwargs)
+    elif name == 'hnsw':
+      self.indexes[name] = HNSWIndex(self.X_train, **kwargs)
+    elif name == 'pq':
+      self.indexes[name] = PQIndex(self.X_train, **kwargs)
+    else:
+      raise ValueError('Invalid index "%s"' % name)
+
+  def condense(self, X_val, y_val, method='kmeans', k=1, tolerance=0.01,
+               prototypes_per_class=10, chunk_size=1000, seed=0):
+    """
+    Shrink the stored training set so that queries get cheaper, as long as
+    the validation accuracy does not drop by more than tolerance. Replaces
+    X_train / y_train (and drops any built indexes) when it succeeds.
+
+    Inputs:
+    - X_val, y_val: Validation data used to check the accuracy.
+    - method: How to pick the references to keep.
+      'cnn': Hart's condensed nearest neighbor; keep a subset such that every
+        training point is classified correctly by its 1-NN in the subset.
+      'enn': Wilson's edited nearest neighbor; drop the training points that
+        their own k nearest neighbors misclassify.
+      'kmeans': replace every class by k-means centroids. The number of
+        centroids starts at prototypes_per_class and is doubled until the
+        accuracy is within tolerance.
+    - k: The k used for predictions during the validation checks.
+    - tolerance: Largest accepted drop in validation accuracy.
+    - prototypes_per_class: Initial number of centroids for 'kmeans'.
+    - chunk_size: Number of points classified at a time by 'cnn'.
+    - seed: Seed for the point order of 'cnn' and the k-means initialization.
+
+    Returns: A dictionary with the number of references before and after,
+    the reduction ratio, the validation accuracy and predict time before and
+    after, the resulting speedup and whether the condensed set was applied.
+    """
+    rng = np.random.RandomState(seed)
+    X, y = np.asarray(self.X_train), self.y_train
+    acc_before, t_before = self._validate(X, y, X_val, y_val, k)
+
+    if method == 'kmeans':
+      largest = np.max(np.bincount(np.unique(y, return_inverse=True)[1]))
+      num_protos = prototypes_per_class
+      while True:
+        X_new, y_new = _class_prototypes(X, y, num_protos, rng)
+        acc_after, t_after = self._validate(X_new, y_new, X_val, y_val, k)
+        if acc_after >= acc_before - tolerance or num_protos >= largest:
+          break
+        num_protos *= 2
+    elif method == 'cnn':
+      keep = self._condensed_nn(X, y, chunk_size, rng)
+      X_new, y_new = X[keep], y[keep]
+      acc_after, t_after = self._validate(X_new, y_new, X_val, y_val, k)
+    elif method == 'enn':
+      keep = self._edited_nn(X, y, k)
+      X_new, y_new = X[keep], y[keep]
+      acc_after, t_after = self._validate(X_new, y_new, X_val, y_val, k)
+    else:
+      raise ValueError('Invalid condensation method "%s"' % method)
+
+    applied = acc_after >= acc_before - tolerance
+    if applied:
+      self.train(X_new, y_new)
+    return {
+      'method': method,
+      'num_before': X.shape[0],
+      'num_after': X_new.shape[0],
+      'ratio': X.shape[0] / float(max(X_new.shape[0], 1)),
+      'acc_before': acc_before,
+      'acc_after': acc_after,
+      'time_before': t_before,
+      'time_after': t_after,
+      'speedup': t_before / max(t_after, 1e-12),
+      'applied': applied,
+    }
+
+  def _copy_with(self, X, y):
+    """ A classifier with the same settings trained on X, y. """
+    knn = KNearestNeighbor(memory_budget=self.memory_budget,
+                           block_size=self.block_size, metric=self.metric)
+    knn.train(X, y)
+    return knn
+
+  def _validate(self, X, y, X_val, y_val, k):
+    """ Validation accuracy and predict time of a classifier on X, y. """
+    knn = self._copy_with(X, y)
+    tic = time.time()
+    y_pred = knn.predict(X_val, k=k)
+    return np.mean(y_pred == y_val), time.time() - tic
+
+  def _condensed_nn(self, X, y, chunk_size, rng):
+    """
+    Indices of a condensed subset of X. Starting from one point per class,
+    chunks of the data are classified by 1-NN against the current subset and
+    the misclassified points are added, until a full pass adds nothing.
+    """
+    num_train = X.shape[0]
+    order = rng.permutation(num_train)
+    _, first = np.unique(y[order], return_index=True)
+    in_store = np.zeros(num_train, dtype=bool)
+    in_store[order[first]] = True
+    changed = True
+    while changed:
+      changed = False
+      for lo in xrange(0, num_train, chunk_size):
+        chunk = order[lo:lo + chunk_size]
+        chunk = chunk[~in_store[chunk]]
+        if chunk.shape[0] == 0:
+          continue
+        store = np.flatnonzero(in_store)
+        _, nn = self._copy_with(X[store], y[store]).query_topk(X[chunk], k=1)
+        wrong = chunk[y[store][nn[:, 0]] != y[chunk]]
+        if wrong.shape[0] > 0:
+          in_store[wrong] = True
+          changed = True
+    return np.flatnonzero(in_store)
+
+  def _edited_nn(self, X, y, k):
+    """
+    Indices of the points of X whose k nearest other training points vote
+    for their own label.
+    """
+    num_train = X.shape[0]
+    _, nn = self._copy_with(X, y).query_topk(X, k=k + 1)
+    # Drop each point's own entry, or the farthest neighbor when duplicates
+    # pushed it out of the list.
+    is_self = nn == np.arange(num_train)[:, np.newaxis]
+    is_self[~is_self.any(axis=1), -1] = True
+    nn = nn[~is_self].reshape(num_train, k)
+    return np.flatnonzero(self.vote_labels(y[nn]) == y)
+
+  def save_index(self, name, path):
+    """
+    Save a built index to disk. Only the 'hnsw' graph supports this; the
+    training data itself is not written.
+    """
+    if name != 'hnsw':
+      raise ValueError('Index "%s" cannot be saved' % name)
+    self.indexes[name].save(path)
+
+  def load_index(self, name, path):
+    """
+    Load an index written by save_index for the current training data, so a
+    serving process does not have to rebuild it after train.
+    """
+    if name != 'hnsw':
+      raise ValueError('Index "%s" cannot be loaded' % name)
+    self.indexes[name] = HNSWIndex.load(path, self.X_train)
+
+  def predict(self, X, k=1, num_loops=0, index=None, approximate=False,
+              n_jobs=1, early_termination=False):
     """
     Predict labels for test data using this classifier.
 
@@ -32,13 +271,49 @@ class KNearestNeighbor(object):
     - k: The number of nearest neighbors that vote for the predicted labels.
     - num_loops: Determines which implementation to use to compute distances
       between training points and testing points.
+    - index: If given, the name of an index built by train / build_index that
+      answers the queries instead of a brute force scan; num_loops is then
+      ignored.
+    - approximate: If true, answer the queries from the LSH index only; it is
+      built with default parameters if train did not build it. Shorthand for
+      index='lsh'.
+    - n_jobs: Number of worker processes for the brute force paths; -1 uses
+      all cores. The test set is split into shards and the training data is
+      shared with the workers through shared memory instead of being copied.
+    - early_termination: With num_loops=1, find the neighbors with the exact
+      partial distance search of query_topk_partial instead of computing
+      every distance in full.
 
     Returns:
     - y: A numpy array of shape (num_test,) containing predicted labels for the
       test data, where y[i] is the predicted label for the test point X[i].  
     """
+    if approximate:
+      if 'lsh' not in self.indexes:
+        self.build_index('lsh')
+      index = 'lsh'
+    if index is not None:
+      if self.metric != 'l2':
+        raise ValueError('Indexes only support the l2 metric')
+      if index not in self.indexes:
+        raise ValueError('Index "%s" has not been built' % index)
+      _, neighbors = self.indexes[index].query(X, k=k)
+      return self.vote_labels(self.y_train[neighbors])
+
+    if self.X_train is None:
+      raise ValueError('Training data was not kept; predict needs an index')
+    if self.metric != 'l2' and (num_loops != 0 or early_termination):
+      raise ValueError('Metric "%s" needs num_loops=0' % self.metric)
+    n_jobs = resolve_n_jobs(n_jobs)
+    if n_jobs > 1:
+      return self._predict_parallel(X, n_jobs, k=k, num_loops=num_loops,
+                                    early_termination=early_termination)
     if num_loops == 0:
-      dists = self.compute_distances_no_loops(X)
+      _, neighbors = self.query_topk(X, k=k)
+      return self.vote_labels(self.y_train[neighbors])
+    elif num_loops == 1 and early_termination:
+      _, neighbors = self.query_topk_partial(X, k=k)
+      return self.vote_labels(self.y_train[neighbors])
     elif num_loops == 1:
       dists = self.compute_distances_one_loop(X)
     elif num_loops == 2:
@@ -48,6 +323,55 @@ class KNearestNeighbor(object):
 
     return self.predict_labels(dists, k=k)
 
+  def _predict_parallel(self, X, n_jobs, **kwargs):
+    """
+    Run predict over shards of X in a pool of n_jobs processes. The shards
+    are a few times more numerous than the workers to balance the load, and
+    the predictions are gathered back in order. The workers are spawned with
+    their BLAS thread pools sized to share the cores between them. kwargs
+    are passed on to predict in the workers.
+    """
+    num_shards = min(X.shape[0], 4 * n_jobs)
+    shards = np.array_split(X, max(num_shards, 1))
+    blas_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+    pool = spawn_pool(n_jobs, blas_threads, _init_predict_worker,
+                      (self._shared_specs(), self._train_map,
+                       self.memory_budget, self.block_size, self.metric))
+    try:
+      y_pred = pool.map(_predict_shard, [(shard, kwargs) for shard in shards])
+    finally:
+      pool.close()
+      pool.join()
+    return np.concatenate(y_pred)
+
+  def _shared_specs(self):
+    """
+    Specs of the training data in shared memory, for attach_arrays in the
+    predict workers. The blocks are created by the first parallel predict
+    after train and reused until the next train (or until the classifier is
+    garbage collected), so repeated predict calls do not copy the training
+    set again.
+    """
+    if getattr(self, '_shared', None) is None:
+      arrays = {
+        'y_train': self.y_train,
+        'train_sq_norms': self.train_sq_norms,
+        'pds_order': self._pds_order,
+      }
+      # A training set memory mapped from disk is mapped again by every
+      # worker rather than copied into shared memory.
+      if self._train_map is None:
+        arrays['X_train'] = self.X_train
+      blocks, specs = share_arrays(arrays)
+      self._shared = (specs, weakref.finalize(self, release_arrays, blocks))
+    return self._shared[0]
+
+  def _release_shared(self):
+    """ Free the shared memory blocks made by _shared_specs, if any. """
+    if getattr(self, '_shared', None) is not None:
+      self._shared[1]()
+    self._shared = None
+
   def compute_distances_two_loops(self, X):
     """
     Compute the distance between each test point in X and each training point
@@ -104,6 +428,72 @@ class KNearestNeighbor(object):
       #######################################################################
     return dists
 
+  def query_topk_partial(self, X, k=1, dim_block=64, chunk_size=None,
+                         reorder=True):
+    """
+    Exact k nearest neighbor search with a single loop over the test data
+    that stops computing a distance as soon as it is known to be too large.
+
+    For every test point the training set is processed in chunks. Squared
+    distances are accumulated over blocks of dim_block dimensions, and after
+    each block the candidates whose partial sum already exceeds the current
+    k-th best distance are dropped. Since a partial sum only grows, the
+    result is exact. With reorder, the dimensions are visited in order of
+    decreasing training variance (computed by train) so the partial sums
+    grow fast and pruning starts early; only the chunk being scanned is
+    copied in that order.
+
+    Inputs:
+    - X: A numpy array of shape (num_test, D) containing test data.
+    - k: The number of neighbors to return per test point.
+    - dim_block: Number of dimensions added to the partial sums at a time.
+    - chunk_size: Number of training points read and reordered at a time;
+      the k-th best distance of a test point is updated after each chunk.
+      Defaults to the training block size of the blocked engine, so a chunk
+      stays within half of self.memory_budget.
+    - reorder: Whether to visit the dimensions by decreasing variance.
+
+    Returns: Same as query_topk.
+    """
+    num_test, dim = X.shape
+    num_train = self.X_train.shape[0]
+    k = min(k, num_train)
+    if chunk_size is None:
+      _, chunk_size = self._tile_shape(1, num_train, k)
+    if reorder:
+      X = X[:, self._pds_order]
+
+    best_d = np.full((num_test, k), np.inf)
+    best_i = np.zeros((num_test, k), dtype=np.int64)
+    for start in xrange(0, num_train, chunk_size):
+      # Every chunk is read (and reordered) once and then scanned by all the
+      # test points, so a memory mapped training set is streamed only once.
+      X_chunk = np.asarray(self.X_train[start:start + chunk_size])
+      if reorder:
+        X_chunk = X_chunk[:, self._pds_order]
+      for i in xrange(num_test):
+        q = X[i]
+        bound = best_d[i].max()
+        ids = np.arange(X_chunk.shape[0])
+        partial = np.zeros(ids.shape[0])
+        for lo in xrange(0, dim, dim_block):
+          hi = lo + dim_block
+          if lo == 0:
+            # Nothing is pruned yet, so the chunk is still a plain slice.
+            diff = X_chunk[:, :hi] - q[:hi]
+          else:
+            diff = X_chunk[ids, lo:hi] - q[lo:hi]
+          partial += np.einsum('ij,ij->i', diff, diff)
+          alive = partial <= bound
+          ids, partial = ids[alive], partial[alive]
+          if ids.shape[0] == 0:
+            break
+        if ids.shape[0] > 0:
+          d, j = merge_topk(best_d[i:i + 1], best_i[i:i + 1],
+                            partial[np.newaxis], start + ids, k)
+          best_d[i], best_i[i] = d[0], j[0]
+    return sort_topk(best_d, best_i)
+
   def compute_distances_no_loops(self, X):
     """
     Compute the distance between each test point in X and each training point
@@ -111,9 +501,6 @@ class KNearestNeighbor(object):
 
     Input / Output: Same as compute_distances_two_loops
     """
-    num_test = X.shape[0]
-    num_train = self.X_train.shape[0]
-    dists = np.zeros((num_test, num_train)) 
     #########################################################################
     # TODO:                                                                 #
     # Compute the l2 distance between all test points and all training      #
@@ -126,12 +513,128 @@ class KNearestNeighbor(object):
     # HINT: Try to formulate the l2 distance using matrix multiplication    #
     #       and two broadcast sums.                                         #
     #########################################################################
-    pass
+    test_sq_norms = np.einsum('ij,ij->i', X, X)
+    dists = np.dot(X, self.X_train.T)
+    dists *= -2
+    dists += test_sq_norms[:, np.newaxis]
+    dists += self.train_sq_norms
+    np.maximum(dists, 0, out=dists)
+    np.sqrt(dists, out=dists)
     #########################################################################
     #                         END OF YOUR CODE                              #
     #########################################################################
     return dists
 
+  def query_topk(self, X, k=1, exclude=None):
+    """
+    Find the k nearest training points of every test point without ever
+    materializing the full (num_test, num_train) distance matrix.
+
+    The test and training sets are walked in tiles. Each tile is computed
+    by the kernel of self.metric (see _tile_distances) and merged into a
+    running top-k per test point, so peak memory is bounded by
+    self.memory_budget rather than by num_test * num_train.
+
+    Inputs:
+    - X: A numpy array of shape (num_test, D) containing test data.
+    - k: The number of neighbors to return per test point.
+    - exclude: Optional (start, stop) range of training indices to skip, e.g.
+      the validation fold during cross-validation.
+
+    Returns a tuple of:
+    - dists: A numpy array of shape (num_test, k) giving the distances to
+      the k nearest training points in increasing order.
+    - neighbors: A numpy array of shape (num_test, k) giving the indices into
+      self.X_train of those training points.
+    """
+    num_test = X.shape[0]
+    num_train = self.X_train.shape[0]
+    if exclude is None:
+      segments = [(0, num_train)]
+    else:
+      segments = [(0, exclude[0]), (exclude[1], num_train)]
+    k = min(k, sum(stop - start for start, stop in segments))
+    rows, cols = self._tile_shape(num_test, num_train, k)
+
+    best_d = np.full((num_test, k), np.inf)
+    best_i = np.zeros((num_test, k), dtype=np.int64)
+    X, test_sq_norms = self._prepare_queries(X)
+
+    # Stream over the training set in the outer loop so every training block
+    # is touched exactly once; only the running top-k is kept per test point.
+    for seg_start, seg_stop in segments:
+      for start in xrange(seg_start, seg_stop, cols):
+        stop = min(start + cols, seg_stop)
+        # Read a memory mapped block into RAM once instead of paging it in
+        # again for every row tile.
+        X_block = np.asarray(self.X_train[start:stop])
+        if isinstance(self.X_train, np.memmap):
+          X_block = X_block.copy()
+        norms_block = self.train_sq_norms[start:stop]
+        ids = np.arange(start, stop)
+        for lo in xrange(0, num_test, rows):
+          hi = min(lo + rows, num_test)
+          tile = self._tile_distances(X[lo:hi], test_sq_norms[lo:hi],
+                                      X_block, norms_block)
+          best_d[lo:hi], best_i[lo:hi] = merge_topk(
+              best_d[lo:hi], best_i[lo:hi], tile, ids, k)
+
+    return sort_topk(best_d, best_i, squared=self.metric == 'l2')
+
+  def _prepare_queries(self, X):
+    """
+    Per query work shared by all tiles: the squared norms for 'l2', and for
+    'cosine' the queries are normalized once up front.
+    """
+    # einsum avoids a temporary the size of X.
+    sq_norms = np.einsum('ij,ij->i', X, X)
+    if self.metric == 'cosine':
+      X = X / np.sqrt(np.maximum(sq_norms, 1e-24))[:, np.newaxis]
+    return X, sq_norms
+
+  def _tile_distances(self, X, sq_norms, X_block, norms_block):
+    """
+    Distances between a tile of prepared queries and a block of training
+    rows, in the units that are ranked: squared distances for 'l2'.
+
+    - 'l2' is ||a||^2 + ||b||^2 - 2ab with a single GEMM.
+    - 'cosine' is one GEMM of the normalized queries against the block,
+      divided by the cached training norms.
+    - 'l1' is a cache blocked broadcast-and-reduce (knn_index.l1_distances).
+    """
+    if self.metric == 'l1':
+      return l1_distances(X, X_block)
+    tile = np.dot(X, X_block.T)
+    if self.metric == 'cosine':
+      tile /= -np.sqrt(np.maximum(norms_block, 1e-24))
+      tile += 1
+      return tile
+    tile *= -2
+    tile += sq_norms[:, np.newaxis]
+    tile += norms_block
+    return tile
+
+  def _tile_shape(self, num_test, num_train, k):
+    """
+    Pick the (test rows, train columns) of a tile. Half of self.memory_budget
+    goes to the GEMM output and the (rows, cols + k) arrays of the top-k
+    merge, the other half to the block of cols training rows the tile is
+    computed from.
+    """
+    budget = self.memory_budget // 2
+    # float64 tile + float64 candidates + int64 candidate indices + int64
+    # argpartition result, all counted at (rows, cols + k)
+    bytes_per_entry = 4 * 8
+    rows = max(1, min(num_test, self.block_size))
+    cols = budget // (bytes_per_entry * rows) - k
+    while cols < k and rows > 1:
+      rows //= 2
+      cols = budget // (bytes_per_entry * rows) - k
+    row_bytes = self.X_train.shape[1] * self.X_train.itemsize
+    cols = min(cols, budget // row_bytes)
+    cols = max(cols, k, 1)
+    return rows, min(cols, num_train)
+
   def predict_labels(self, dists, k=1):
     """
     Given a matrix of distances between test points and training points,
@@ -145,33 +648,121 @@ class KNearestNeighbor(object):
     - y: A numpy array of shape (num_test,) containing predicted labels for the
       test data, where y[i] is the predicted label for the test point X[i].  
     """
-    num_test = dists.shape[0]
-    y_pred = np.zeros(num_test)
-    for i in xrange(num_test):
-      # A list of length k storing the labels of the k nearest neighbors to
-      # the ith test point.
-      closest_y = []
-      #########################################################################
-      # TODO:                                                                 #
-      # Use the distance matrix to find the k nearest neighbors of the ith    #
-      # testing point, and use self.y_train to find the labels of these       #
-      # neighbors. Store these labels in closest_y.                           #
-      # Hint: Look up the function numpy.argsort.                             #
-      #########################################################################
-      closest_y=np.argsort(dists[i])[:k]
-      #########################################################################
-      # TODO:                                                                 #
-      # Now that you have found the labels of the k nearest neighbors, you    #
-      # need to find the most common label in the list closest_y of labels.   #
-      # Store this label in y_pred[i]. Break ties by choosing the smaller     #
-      # label.                                                                #
-      #########################################################################
-      (values,counts) = np.unique(self.y_train[closest_y],return_counts=True)
-      ind=np.argmax(counts)
-      y_pred[i] = values[ind]
-      #########################################################################
-      #                           END OF YOUR CODE                            # 
-      #########################################################################
-
-    return y_pred
+    num_test, num_train = dists.shape
+    k = min(k, num_train)
+    # Select the k nearest neighbors of every test point at once. A partial
+    # sort is enough since the order within the top k does not matter for the
+    # vote.
+    closest = np.argpartition(dists, k - 1, axis=1)[:, :k]
+    closest_y = self.y_train[closest]
+    return self.vote_labels(closest_y)
+
+  def vote_labels(self, closest_y):
+    """
+    Majority vote over the labels of the nearest neighbors of each test point.
+    Ties are broken by choosing the smaller label.
+
+    Inputs:
+    - closest_y: A numpy array of shape (num_test, k) where closest_y[i] holds
+      the labels of the k nearest neighbors of the ith test point.
+
+    Returns:
+    - y: A numpy array of shape (num_test,) containing predicted labels.
+    """
+    num_test = closest_y.shape[0]
+    classes, inverse = np.unique(closest_y, return_inverse=True)
+    inverse = inverse.reshape(closest_y.shape)
+    num_classes = classes.shape[0]
+    # Count votes for all test points with a single bincount over the
+    # flattened (test point, class) pairs.
+    flat = inverse + num_classes * np.arange(num_test)[:, np.newaxis]
+    counts = np.bincount(flat.ravel(), minlength=num_test * num_classes)
+    counts = counts.reshape(num_test, num_classes)
+    # classes is sorted and argmax returns the first maximum, so ties go to
+    # the smaller label.
+    return classes[np.argmax(counts, axis=1)]
+
+
+def _class_prototypes(X, y, num_protos, rng):
+  """
+  Replace every class in X by up to num_protos k-means centroids.
+
+  Returns a tuple (X_protos, y_protos).
+  """
+  X_protos, y_protos = [], []
+  for c in np.unique(y):
+    X_c = X[y == c]
+    centroids, _ = kmeans(X_c, min(num_protos, X_c.shape[0]), rng=rng)
+    X_protos.append(centroids)
+    y_protos.append(np.full(centroids.shape[0], c, dtype=y.dtype))
+  return np.concatenate(X_protos), np.concatenate(y_protos)
+
+
+# State of a predict worker process, set up by _init_predict_worker.
+_worker = {}
+
+
+def _init_predict_worker(specs, train_map, memory_budget, block_size, metric):
+  blocks, arrays = attach_arrays(specs)
+  knn = KNearestNeighbor(memory_budget=memory_budget, block_size=block_size,
+                         metric=metric)
+  if train_map is None:
+    knn.X_train = arrays['X_train']
+    knn.train_path = None
+  else:
+    filename, dtype, shape, offset, order = train_map
+    knn.X_train = np.memmap(filename, dtype=dtype, mode='r', offset=offset,
+                            shape=shape, order=order)
+    knn.train_path = filename
+  knn._train_map = train_map
+  knn.y_train = arrays['y_train']
+  knn.train_sq_norms = arrays['train_sq_norms']
+  knn._pds_order = arrays['pds_order']
+  knn.indexes = {}
+  _worker['blocks'] = blocks
+  _worker['knn'] = knn
+
+
+def _predict_shard(args):
+  X, kwargs = args
+  return _worker['knn'].predict(X, **kwargs)
+
+
+def cross_validate_knn(X, y, folds=5, k_choices=(1, 3, 5, 8, 10, 12, 15, 20,
+                                                   50, 100), knn=None):
+  """
+  k-fold cross-validation of KNearestNeighbor over several values of k.
+
+  The data is split into contiguous folds. For every fold the neighbors among
+  the other folds are found once, up to the largest k, with the blocked
+  distance engine; every k is then scored from prefixes of that single sorted
+  neighbor list. The whole sweep costs about one all-pairs distance
+  computation instead of one per (fold, k) pair.
+
+  Inputs:
+  - X: A numpy array of shape (N, D) of training data.
+  - y: A numpy array of shape (N,) of training labels.
+  - folds: Number of folds.
+  - k_choices: Values of k to evaluate.
+  - knn: Optional KNearestNeighbor instance whose memory settings are used;
+    it is not retrained.
 
+  Returns:
+  - k_to_accuracies: Dictionary mapping every k in k_choices to the list of
+    its accuracies on the folds.
+  """
+  if knn is None:
+    knn = KNearestNeighbor()
+  knn = knn._copy_with(X, y)
+  sizes = [len(f) for f in np.array_split(np.arange(X.shape[0]), folds)]
+  bounds = np.cumsum([0] + sizes)
+  k_max = max(k_choices)
+  k_to_accuracies = dict((k, []) for k in k_choices)
+  for i in xrange(folds):
+    lo, hi = bounds[i], bounds[i + 1]
+    _, neighbors = knn.query_topk(X[lo:hi], k=k_max, exclude=(lo, hi))
+    closest_y = y[neighbors]
+    for k in k_choices:
+      y_pred = knn.vote_labels(closest_y[:, :k])
+      k_to_accuracies[k].append(np.mean(y_pred == y[lo:hi]))
+  return k_to_accuracies
@@ -1,24 +1,45 @@
 from __future__ import print_function
 
 import numpy as np
+from scipy import optimize, sparse
 from cs231n.classifiers.linear_svm import *
 from cs231n.classifiers.softmax import *
+from cs231n.sampler import MinibatchSampler
 from past.builtins import xrange
 
 
 class LinearClassifier(object):
 
-  def __init__(self):
+  def __init__(self, dtype=np.float64):
+    """
+    Inputs:
+    - dtype: numpy datatype of the weights, gradients and scores, e.g.
+      np.float32 to halve their memory and speed up the products when the
+      data is float32 as well. Losses are accumulated in float64 either way.
+    """
+    self.dtype = dtype
     self.W = None
+    # Preallocated buffers of the subclass loss, created on the first call.
+    self.workspace = None
 
   def train(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
-            batch_size=200, verbose=False):
+            batch_size=200, verbose=False, sampler_options=None,
+            loss_tol=None, grad_tol=None, X_val=None, y_val=None,
+            patience=None, check_every=10, solver='sgd', chunk_size=10000):
     """
-    Train this linear classifier using stochastic gradient descent.
+    Train this linear classifier using stochastic gradient descent, one of
+    its variance reduced variants, or L-BFGS on the full-batch loss.
+
+    Training stops before num_iters when the loss becomes inf or nan, or when
+    one of the optional stopping criteria is met. The criteria are only
+    evaluated every check_every iterations to keep their cost low. The number
+    of iterations actually run is stored in self.stop_iteration.
 
     Inputs:
-    - X: A numpy array of shape (N, D) containing training data; there are N
-      training samples each of dimension D.
+    - X: A numpy array or scipy.sparse matrix (converted to CSR) of shape
+      (N, D) containing training data; there are N training samples each of
+      dimension D. With sparse data the cost of an iteration scales with the
+      number of non-zeros of the minibatch rather than with D.
     - y: A numpy array of shape (N,) containing training labels; y[i] = c
       means that X[i] has label 0 <= c < C for C classes.
     - learning_rate: (float) learning rate for optimization.
@@ -26,18 +47,73 @@ class LinearClassifier(object):
     - num_iters: (integer) number of steps to take when optimizing
     - batch_size: (integer) number of training examples to use at each step.
     - verbose: (boolean) If true, print progress during optimization.
+    - sampler_options: Optional dictionary of keyword arguments for
+      cs231n.sampler.MinibatchSampler (block_size, in_place, prefetch, seed),
+      which draws the minibatches from a once per epoch shuffle of the data.
+    - loss_tol: Stop when the exponentially smoothed minibatch loss decreased
+      by less than this fraction since the previous check.
+    - grad_tol: Stop when the norm of the minibatch gradient is below this.
+    - X_val, y_val: Validation data and labels for patience; required when
+      patience is given.
+    - patience: Stop when the validation accuracy has not improved for this
+      many checks; self.W is then reset to the weights with the best
+      validation accuracy.
+    - check_every: Number of iterations between checks of the criteria.
+    - solver: One of
+      'sgd': Minibatch stochastic gradient descent.
+      'asgd': SGD with Polyak averaging; self.W ends up as the average of the
+        iterates from the end of the first epoch (or from halfway through
+        training, if that is sooner) on.
+      'svrg': Stochastic variance reduced gradient. At the start of every
+        epoch the full-batch gradient is computed at a snapshot of W, and
+        each step corrects its minibatch gradient with it, so a constant
+        learning rate converges without the noise floor of SGD. Stopping
+        criteria other than non-finite losses are not used.
+      'dcd': LinearSVM only; one-vs-rest dual coordinate descent, see
+        svm_dual_coordinate_descent. num_iters bounds the passes over the
+        data and grad_tol (default 0.1) is the tolerance on the dual
+        gradients; the other minibatch and stopping options are not used.
+      'lbfgs': L-BFGS on the full-batch loss (the smoothed SVM loss for
+        LinearSVM). L-BFGS needs no learning rate; num_iters bounds its
+        iterations, grad_tol (default 1e-5) is its tolerance on the largest
+        gradient entry, and the other minibatch and stopping options are not
+        used.
+    - chunk_size: Number of rows per chunk when the full-batch loss is
+      evaluated, bounding the memory for the scores.
 
     Outputs:
     A list containing the value of the loss function at each training iteration.
     """
+    if patience is not None and (X_val is None or y_val is None):
+      raise ValueError('patience needs X_val and y_val')
+    if sparse.issparse(X):
+      X = X.tocsr()
     num_train, dim = X.shape
     num_classes = np.max(y) + 1 # assume y takes values 0...K-1 where K is number of classes
     if self.W is None:
       # lazily initialize W
-      self.W = 0.001 * np.random.randn(dim, num_classes)
+      self.W = (0.001 * np.random.randn(dim, num_classes)).astype(self.dtype)
+    if solver == 'lbfgs':
+      return self._train_lbfgs(X, y, reg, num_iters, grad_tol, chunk_size,
+                               verbose)
+    elif solver == 'dcd':
+      return self._train_dcd(X, y, reg, num_iters, grad_tol, verbose,
+                             sampler_options)
+    elif solver == 'svrg':
+      return self._train_svrg(X, y, learning_rate, reg, num_iters, batch_size,
+                              chunk_size, verbose, sampler_options)
+    elif solver not in ('sgd', 'asgd'):
+      raise ValueError('Invalid solver "%s"' % solver)
 
     # Run stochastic gradient descent to optimize W
+    sampler, next_batch = self._sampler(X, y, batch_size, sampler_options)
+    if solver == 'asgd':
+      average_start = min(sampler.batches_per_epoch, num_iters // 2)
+      W_avg = self.W.copy()
     loss_history = []
+    self.stop_iteration = num_iters
+    smoothed_loss = last_smoothed_loss = None
+    best_val_acc, best_W, bad_checks = -1, None, 0
     for it in xrange(num_iters):
       X_batch = None
       y_batch = None
@@ -53,7 +129,7 @@ class LinearClassifier(object):
       # Hint: Use np.random.choice to generate indices. Sampling with         #
       # replacement is faster than sampling without replacement.              #
       #########################################################################
-      pass
+      X_batch, y_batch = next_batch()
       #########################################################################
       #                       END OF YOUR CODE                                #
       #########################################################################
@@ -61,30 +137,377 @@ class LinearClassifier(object):
       # evaluate loss and gradient
       loss, grad = self.loss(X_batch, y_batch, reg)
       loss_history.append(loss)
+      if not np.isfinite(loss):
+        self.stop_iteration = it + 1
+        if verbose:
+          print('iteration %d / %d: loss diverged' % (it, num_iters))
+        break
+      smoothed_loss = loss if smoothed_loss is None else (
+          0.9 * smoothed_loss + 0.1 * loss)
+      check = (it + 1) % check_every == 0
+      stop = (check and grad_tol is not None and
+              np.linalg.norm(grad) < grad_tol)
 
       # perform parameter update
       #########################################################################
       # TODO:                                                                 #
       # Update the weights using the gradient and the learning rate.          #
       #########################################################################
-      pass
+      grad *= learning_rate
+      self.W -= grad
       #########################################################################
       #                       END OF YOUR CODE                                #
       #########################################################################
+      if solver == 'asgd':
+        if it < average_start:
+          W_avg[...] = self.W
+        else:
+          W_avg += (self.W - W_avg) / (it - average_start + 2.0)
 
       if verbose and it % 100 == 0:
         print('iteration %d / %d: loss %f' % (it, num_iters, loss))
 
+      if check and loss_tol is not None:
+        if last_smoothed_loss is not None:
+          decrease = last_smoothed_loss - smoothed_loss
+          stop = stop or decrease < loss_tol * abs(last_smoothed_loss)
+        last_smoothed_loss = smoothed_loss
+      if check and patience is not None:
+        val_acc = np.mean(self.predict(X_val) == y_val)
+        if val_acc > best_val_acc:
+          best_val_acc, best_W, bad_checks = val_acc, self.W.copy(), 0
+        else:
+          bad_checks += 1
+          stop = stop or bad_checks >= patience
+      if stop:
+        self.stop_iteration = it + 1
+        if verbose:
+          print('iteration %d / %d: converged' % (it, num_iters))
+        break
+
+    if best_W is not None:
+      self.W = best_W
+    elif solver == 'asgd':
+      self.W = W_avg
     return loss_history
 
+  def _train_dcd(self, X, y, reg, num_iters, grad_tol, verbose,
+                 sampler_options):
+    """
+    Dual coordinate descent; see train. Subclasses with a dual solver
+    override this.
+    """
+    raise ValueError('Invalid solver "dcd" for %s' % type(self).__name__)
+
+  def _train_svrg(self, X, y, learning_rate, reg, num_iters, batch_size,
+                  chunk_size, verbose, sampler_options):
+    """
+    Stochastic variance reduced gradient descent on self.W; see train.
+    """
+    sampler, next_batch = self._sampler(X, y, batch_size, sampler_options)
+    epoch_iters = sampler.batches_per_epoch
+    loss_history = []
+    self.stop_iteration = num_iters
+    for it in xrange(num_iters):
+      if it % epoch_iters == 0:
+        W_snapshot = self.W.copy()
+        _, full_grad = self.full_batch_loss(X, y, reg, W_snapshot, chunk_size)
+        # The regularization gradient is exact, only the data part is
+        # corrected.
+        full_grad -= 2 * reg * W_snapshot
+
+      X_batch, y_batch = next_batch()
+      data_loss, dscores = self.loss_from_scores(X_batch.dot(self.W), y_batch)
+      _, dscores_snapshot = self.loss_from_scores(X_batch.dot(W_snapshot),
+                                                  y_batch)
+      loss = data_loss + reg * np.sum(self.W * self.W, dtype=np.float64)
+      loss_history.append(loss)
+      if not np.isfinite(loss):
+        self.stop_iteration = it + 1
+        if verbose:
+          print('iteration %d / %d: loss diverged' % (it, num_iters))
+        break
+
+      dscores -= dscores_snapshot
+      grad = X_batch.T.dot(dscores)
+      grad += full_grad
+      grad += 2 * reg * self.W
+      grad *= learning_rate
+      self.W -= grad
+
+      if verbose and it % 100 == 0:
+        print('iteration %d / %d: loss %f' % (it, num_iters, loss))
+    return loss_history
+
+  def full_batch_loss(self, X, y, reg, W=None, chunk_size=10000,
+                      smooth=False):
+    """
+    Loss and gradient over a whole dataset, evaluated in chunks of
+    chunk_size rows so that only the scores of one chunk are in memory.
+
+    Inputs:
+    - X, y: Data and labels, as for train.
+    - reg: (float) regularization strength.
+    - W: Weights to evaluate; self.W by default.
+    - chunk_size: Number of rows per chunk.
+    - smooth: Use smooth_loss_from_scores instead of loss_from_scores.
+
+    Returns: A tuple of the loss as a single float and its gradient with
+    respect to W.
+    """
+    if W is None:
+      W = self.W
+    loss_from_scores = (self.smooth_loss_from_scores if smooth else
+                        self.loss_from_scores)
+    num_train = X.shape[0]
+    loss, grad = reg * np.sum(W * W, dtype=np.float64), 2 * reg * W
+    for lo in xrange(0, num_train, chunk_size):
+      X_chunk, y_chunk = X[lo:lo + chunk_size], y[lo:lo + chunk_size]
+      weight = X_chunk.shape[0] / float(num_train)
+      data_loss, dscores = loss_from_scores(X_chunk.dot(W), y_chunk)
+      loss += weight * data_loss
+      grad += weight * X_chunk.T.dot(dscores)
+    return loss, grad
+
+  def _train_lbfgs(self, X, y, reg, num_iters, grad_tol, chunk_size, verbose):
+    """
+    Minimize the full-batch loss over self.W with L-BFGS; see train. Every
+    loss evaluation is one pass over X in chunks of chunk_size rows.
+    """
+    shape = self.W.shape
+    evaluations = []
+
+    def full_batch_loss(w):
+      loss, grad = self.full_batch_loss(X, y, reg, w.reshape(shape),
+                                        chunk_size, smooth=True)
+      evaluations.append(loss)
+      return loss, grad.ravel()
+
+    loss_history = []
+
+    def callback(w):
+      loss_history.append(evaluations[-1])
+      if verbose and len(loss_history) % 10 == 1:
+        print('iteration %d / %d: loss %f' % (
+            len(loss_history) - 1, num_iters, loss_history[-1]))
+
+    result = optimize.minimize(
+        full_batch_loss, self.W.ravel(), jac=True, method='L-BFGS-B',
+        callback=callback, options={
+          'maxiter': num_iters,
+          'gtol': 1e-5 if grad_tol is None else grad_tol,
+        })
+    self.W = result.x.reshape(shape).astype(self.dtype)
+    self.stop_iteration = result.nit
+    if verbose:
+      print('L-BFGS stopped after %d iterations and %d passes: %s' % (
+          result.nit, result.nfev, result.message))
+    return loss_history
+
+  def train_stream(self, source, learning_rate=1e-3, reg=1e-5, num_passes=1,
+                   batch_size=200, num_classes=None, verbose=False,
+                   sampler_options=None):
+    """
+    Train this linear classifier using stochastic gradient descent on data
+    that arrives in chunks, such as one CIFAR-10 batch file (see
+    cs231n.data_utils.iter_CIFAR10_batches) or one slice of a memory mapped
+    array at a time, so that only the current chunk has to be in memory.
+
+    Every pass visits the chunks in the order of the source; each chunk is
+    shuffled on its own and cut into minibatches, so every row is used once
+    per pass.
+
+    Inputs:
+    - source: An iterable of (X, y) chunks, X of shape (N_i, D) and y of shape
+      (N_i,), or a function returning a new iterator of chunks. For more than
+      one pass the source is iterated once per pass, which a generator cannot
+      do; pass the function creating it instead.
+    - learning_rate: (float) learning rate for optimization.
+    - reg: (float) regularization strength.
+    - num_passes: (integer) number of passes over the source.
+    - batch_size: (integer) number of training examples to use at each step.
+    - num_classes: Number of classes C; by default one more than the largest
+      label of the first chunk.
+    - verbose: (boolean) If true, print progress after each chunk.
+    - sampler_options: As for train, applied to each chunk. A seed seeds
+      the whole run; every chunk of every pass is shuffled with its own seed
+      drawn from it.
+
+    Outputs:
+    A list containing the value of the loss function at each training iteration.
+    """
+    if num_passes > 1 and not callable(source) and iter(source) is source:
+      raise ValueError('an iterator can only be used for one pass; pass a '
+                       'function returning the iterator instead')
+    sampler_options = dict(sampler_options or {})
+    seed = sampler_options.pop('seed', None)
+    if seed is None:
+      seed = np.random.randint(2 ** 31)
+    rng = np.random.RandomState(seed)
+    loss_history = []
+    for p in xrange(num_passes):
+      chunks = source() if callable(source) else source
+      for c, (X, y) in enumerate(chunks):
+        if self.W is None:
+          # lazily initialize W
+          if num_classes is None:
+            num_classes = np.max(y) + 1
+          self.W = (0.001 * np.random.randn(X.shape[1], num_classes)).astype(
+              self.dtype)
+
+        sampler, next_batch = self._sampler(
+            X, y, batch_size, dict(sampler_options, seed=rng.randint(2 ** 31)))
+        for _ in xrange(sampler.batches_per_epoch):
+          X_batch, y_batch = next_batch()
+          loss, grad = self.loss(X_batch, y_batch, reg)
+          loss_history.append(loss)
+          grad *= learning_rate
+          self.W -= grad
+
+        if verbose:
+          print('pass %d / %d, chunk %d: loss %f' % (
+              p + 1, num_passes, c + 1, loss_history[-1]))
+    return loss_history
+
+  def _sampler(self, X, y, batch_size, sampler_options):
+    """
+    Returns a MinibatchSampler over X and y and a function returning its next
+    minibatch (X_batch, y_batch). A sparse X is converted to CSR; the sampler
+    then shuffles row indices instead and each minibatch is gathered from X.
+    """
+    if not sparse.issparse(X):
+      sampler = MinibatchSampler(X, y, batch_size, **(sampler_options or {}))
+      return sampler, sampler.next_batch
+    X = X.tocsr()
+    sampler = MinibatchSampler(np.arange(X.shape[0]), y, batch_size,
+                               **(sampler_options or {}))
+
+    def next_batch():
+      rows, y_batch = sampler.next_batch()
+      return X[rows], y_batch
+    return sampler, next_batch
+
+  def fit_path(self, X, y, regs, X_val=None, y_val=None, warm_num_iters=None,
+               **train_kwargs):
+    """
+    Train one model per regularization strength, from the strongest to the
+    weakest, starting every fit from the weights of the previous one. The
+    solutions for neighboring strengths are close, so the warm started fits
+    converge in far fewer iterations than cold starts; this pays off with the
+    solvers that stop on convergence ('lbfgs', or SGD with loss_tol, grad_tol
+    or patience) or with a smaller warm_num_iters. ('dcd' always starts from
+    W = 0.) Afterwards self.W holds the model with the best validation
+    accuracy (or training accuracy if no validation data is given).
+
+    Inputs:
+    - X, y: Training data and labels, as for train.
+    - regs: Sequence of regularization strengths.
+    - X_val, y_val: Optional validation data and labels.
+    - warm_num_iters: Optional num_iters for every fit but the first.
+    - train_kwargs: Other keyword arguments for train.
+
+    Returns: A list with one tuple (reg, W, train_accuracy,
+    validation_accuracy, num_iters) per strength, from the strongest to the
+    weakest. The validation accuracy is None without validation data, and
+    num_iters is the number of iterations the fit ran.
+    """
+    self.W = None
+    path = []
+    for reg in sorted(regs, reverse=True):
+      if path and warm_num_iters is not None:
+        train_kwargs['num_iters'] = warm_num_iters
+      self.train(X, y, reg=reg, **train_kwargs)
+      train_acc = np.mean(self.predict(X) == y)
+      val_acc = (np.mean(self.predict(X_val) == y_val)
+                 if X_val is not None else None)
+      path.append((reg, self.W.copy(), train_acc, val_acc,
+                   self.stop_iteration))
+
+    best = max(path, key=lambda fit: fit[3] if X_val is not None else fit[2])
+    self.W = best[1].copy()
+    return path
+
+  def train_grid(self, X, y, learning_rates, regs, X_val=None, y_val=None,
+                 num_iters=100, batch_size=200, verbose=False):
+    """
+    Train one model per (learning rate, regularization strength) pair with
+    stochastic gradient descent, all at the same time.
+
+    The weights of the M = len(learning_rates) * len(regs) models are stacked
+    side by side into a single (D, C * M) matrix. Every iteration samples one
+    minibatch that all models share, so the scores of every model come from a
+    single GEMM with X_batch and the gradients from a single GEMM with
+    X_batch.T. Afterwards self.W holds the model with the best validation
+    accuracy (or training accuracy if no validation data is given).
+
+    Inputs:
+    - X, y: Training data and labels, as for train.
+    - learning_rates: Sequence of learning rates to try.
+    - regs: Sequence of regularization strengths to try.
+    - X_val, y_val: Optional validation data and labels.
+    - num_iters, batch_size, verbose: As for train.
+
+    Returns a tuple of:
+    - results: Dictionary mapping (learning_rate, reg) to the tuple
+      (training_accuracy, validation_accuracy); the validation accuracy is
+      None without validation data.
+    - loss_histories: Dictionary mapping (learning_rate, reg) to the list of
+      losses at each training iteration.
+    """
+    num_train, dim = X.shape
+    num_classes = np.max(y) + 1
+    configs = [(lr, reg) for lr in learning_rates for reg in regs]
+    num_models = len(configs)
+    model_regs = np.array([reg for _, reg in configs])
+    # Per column learning rate and regularization of the stacked weights.
+    col_lrs = np.repeat([lr for lr, _ in configs], num_classes)
+    col_regs = np.repeat(model_regs, num_classes)
+
+    W = (0.001 * np.random.randn(dim, num_classes * num_models)).astype(
+        self.dtype)
+    loss_history = np.zeros((num_iters, num_models))
+    for it in xrange(num_iters):
+      idx = np.random.choice(num_train, batch_size)
+      X_batch, y_batch = X[idx], y[idx]
+
+      scores = X_batch.dot(W).reshape(batch_size, num_models, num_classes)
+      data_loss, dscores = self.loss_from_scores(scores, y_batch)
+      grad = X_batch.T.dot(dscores.reshape(batch_size, -1))
+      grad += 2 * col_regs * W
+      reg_loss = np.sum(W * W, axis=0, dtype=np.float64).reshape(
+          num_models, -1).sum(axis=1)
+      loss_history[it] = data_loss + model_regs * reg_loss
+
+      W -= col_lrs * grad
+
+      if verbose and it % 100 == 0:
+        print('iteration %d / %d: best loss %f' % (
+            it, num_iters, loss_history[it].min()))
+
+    def accuracies(X, y):
+      scores = X.dot(W).reshape(X.shape[0], num_models, num_classes)
+      return np.mean(np.argmax(scores, axis=2) == y[:, np.newaxis], axis=0)
+
+    train_acc = accuracies(X, y)
+    val_acc = accuracies(X_val, y_val) if X_val is not None else None
+    best = np.argmax(val_acc if val_acc is not None else train_acc)
+    self.W = W.reshape(dim, num_models, num_classes)[:, best].copy()
+
+    results, loss_histories = {}, {}
+    for m, config in enumerate(configs):
+      results[config] = (train_acc[m],
+                         val_acc[m] if val_acc is not None else None)
+      loss_histories[config] = loss_history[:, m].tolist()
+    return results, loss_histories
+
   def predict(self, X):
     """
     Use the trained weights of this linear classifier to predict labels for
     data points.
 
     Inputs:
-    - X: A numpy array of shape (N, D) containing training data; there are N
-      training samples each of dimension D.
+    - X: A numpy array or scipy.sparse matrix of shape (N, D) containing
+      training data; there are N training samples each of dimension D.
 
     Returns:
     - y_pred: Predicted labels for the data in X. y_pred is a 1-dimensional
@@ -96,7 +519,7 @@ class LinearClassifier(object):
     # TODO:                                                                   #
     # Implement this method. Store the predicted labels in y_pred.            #
     ###########################################################################
-    pass
+    y_pred = np.argmax(X.dot(self.W), axis=1)
     ###########################################################################
     #                           END OF YOUR CODE                              #
     ###########################################################################
@@ -108,8 +531,8 @@ class LinearClassifier(object):
     Subclasses will override this.
 
     Inputs:
-    - X_batch: A numpy array of shape (N, D) containing a minibatch of N
-      data points; each point has dimension D.
+    - X_batch: A numpy array or scipy.sparse CSR matrix of shape (N, D)
+      containing a minibatch of N data points; each point has dimension D.
     - y_batch: A numpy array of shape (N,) containing labels for the minibatch.
     - reg: (float) regularization strength.
 
@@ -119,17 +542,67 @@ class LinearClassifier(object):
     """
     pass
 
+  def loss_from_scores(self, scores, y_batch):
+    """
+    Data loss and its derivative computed from precomputed class scores.
+    Subclasses will override this; it is used by train_grid.
+
+    Inputs:
+    - scores: A numpy array of shape (N, M, C) of class scores of M models.
+    - y_batch: A numpy array of shape (N,) containing labels.
+
+    Returns: A tuple of the average data loss of each model, an array of
+    shape (M,), and the gradient with respect to scores.
+    """
+    pass
+
+  def smooth_loss_from_scores(self, scores, y_batch):
+    """
+    Continuously differentiable version of loss_from_scores, minimized by
+    the L-BFGS solver. Subclasses whose loss is not smooth override this.
+    """
+    return self.loss_from_scores(scores, y_batch)
+
 
 class LinearSVM(LinearClassifier):
   """ A subclass that uses the Multiclass SVM loss function """
 
   def loss(self, X_batch, y_batch, reg):
-    return svm_loss_vectorized(self.W, X_batch, y_batch, reg)
+    # Same as svm_loss_vectorized, but the returned gradient is only valid
+    # until the next call.
+    if self.workspace is None:
+      self.workspace = SVMLossWorkspace()
+    return self.workspace(self.W, X_batch, y_batch, reg)
+
+  def loss_from_scores(self, scores, y_batch):
+    return svm_loss_scores(scores, y_batch)
+
+  def smooth_loss_from_scores(self, scores, y_batch):
+    return svm_loss_smooth_scores(scores, y_batch)
+
+  def _train_dcd(self, X, y, reg, num_iters, grad_tol, verbose,
+                 sampler_options):
+    # The dual variables start at zero, so the solver starts from W = 0
+    # rather than from self.W. The history holds one objective per pass.
+    W, loss_history = svm_dual_coordinate_descent(
+        X, y, self.W.shape[1], reg, max_passes=num_iters,
+        tol=0.1 if grad_tol is None else grad_tol,
+        seed=(sampler_options or {}).get('seed'), verbose=verbose)
+    self.W = W.astype(self.dtype)
+    self.stop_iteration = len(loss_history)
+    return loss_history
 
 
 class Softmax(LinearClassifier):
   """ A subclass that uses the Softmax + Cross-entropy loss function """
 
   def loss(self, X_batch, y_batch, reg):
-    return softmax_loss_vectorized(self.W, X_batch, y_batch, reg)
+    # Same as softmax_loss_vectorized, but the returned gradient is only valid
+    # until the next call.
+    if self.workspace is None:
+      self.workspace = SoftmaxLossWorkspace()
+    return self.workspace(self.W, X_batch, y_batch, reg)
+
+  def loss_from_scores(self, scores, y_batch):
+    return softmax_loss_scores(scores, y_batch)
 
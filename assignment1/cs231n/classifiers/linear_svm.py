@@ -1,6 +1,7 @@
 import numpy as np
 from random import shuffle
 from past.builtins import xrange
+from scipy import sparse
 
 def svm_loss_naive(W, X, y, reg):
   """
@@ -37,14 +38,15 @@ def svm_loss_naive(W, X, y, reg):
       if margin > 0:
         loss += margin
         dW[:,j] += X[i]
+        dW[:,y[i]] -= X[i]
 
   # Right now the loss is a sum over all training examples, but we want it
   # to be an average instead so we divide by num_train.
   loss /= num_train
   dW   /= num_train
   # Add regularization to the loss.
-  loss += reg * np.sum(W * W)
-  dW   += reg * W
+  loss += reg * np.sum(W * W, dtype=np.float64)
+  dW   += 2 * reg * W
   #############################################################################
   # TODO:                                                                     #
   # Compute the gradient of the loss function and store it dW.                #
@@ -62,34 +64,19 @@ def svm_loss_vectorized(W, X, y, reg):
   """
   Structured SVM loss function, vectorized implementation.
 
-  Inputs and outputs are the same as svm_loss_naive.
+  Inputs and outputs are the same as svm_loss_naive, except that X may also be
+  a scipy.sparse matrix.
   """
   loss = 0.0
   dW = np.zeros(W.shape) # initialize the gradient as zero
-  num_train = X.shape[0]
   #############################################################################
   # TODO:                                                                     #
   # Implement a vectorized version of the structured SVM loss, storing the    #
   # result in loss.                                                           #
   #############################################################################
-  S  = np.dot(X,W)
-  
-  widIndex = range(0,S.shape[0])
-  print('The shape of y and S')
-  print(y)
-  print( S.shape)
-  correct_class_scores = S[widIndex,y]
-  S[widIndex,y] -= 1
-  margins = S.T - correct_class_scores.T + 1
-  margins = np.clip(margins,0,None)
-  margins_mask = np.zeros(margins.shape)  
-  margins_mask[np.nonzero(margins)]  = 1
-  loss    = np.sum(margins) 
-  dW      += np.matmul(margins_mask,X).T
-  loss /= num_train
-  dW   /= num_train
-  loss += reg * np.sum(W * W)
-  dW   += reg * W
+  scores = X.dot(W)
+  loss, dscores = svm_loss_scores(scores, y)
+  loss += reg * np.sum(W * W, dtype=np.float64)
   #############################################################################
   #                             END OF YOUR CODE                              #
   #############################################################################
@@ -104,9 +91,264 @@ def svm_loss_vectorized(W, X, y, reg):
   # to reuse some of the intermediate values that you used to compute the     #
   # loss.                                                                     #
   #############################################################################
-  
+  dW = X.T.dot(dscores)
+  dW += 2 * reg * W
   #############################################################################
   #                             END OF YOUR CODE                              #
   #############################################################################
 
   return loss, dW
+
+
+def svm_loss_scores(S, y):
+  """
+  Data part of the structured SVM loss computed from class scores, for one
+  or several models evaluated on the same minibatch.
+
+  Inputs:
+  - S: A numpy array of shape (N, C), or (N, M, C) for M models, of scores.
+  - y: A numpy array of shape (N,) containing training labels.
+
+  Returns a tuple of:
+  - loss: Average data loss; a float, or an array of shape (M,).
+  - dS: Gradient of the loss with respect to S; same shape as S.
+  """
+  num_train = S.shape[0]
+  rows = np.arange(num_train)
+  correct_class_scores = S[rows, ..., y]
+  margins = S - correct_class_scores[..., np.newaxis] + 1 # note delta = 1
+  np.maximum(margins, 0, out=margins)
+  margins[rows, ..., y] = 0
+  loss = np.sum(margins, axis=(0, -1), dtype=np.float64) / num_train
+
+  dS = (margins > 0).astype(S.dtype)
+  dS[rows, ..., y] = -np.sum(dS, axis=-1)
+  dS /= num_train
+  return loss, dS
+
+
+def svm_loss_smooth_scores(S, y, smoothing=0.5):
+  """
+  Smoothed structured SVM loss computed from class scores. Each margin
+  m = s_j - s_y + 1 costs 0 for m <= 0, m^2 / (2 * smoothing) for
+  0 < m < smoothing and m - smoothing / 2 above, so the loss is continuously
+  differentiable (as quasi-Newton solvers need) and tends to the hinge loss
+  of svm_loss_scores as smoothing goes to 0.
+
+  Inputs:
+  - S: A numpy array of shape (N, C), or (N, M, C) for M models, of scores.
+  - y: A numpy array of shape (N,) containing training labels.
+  - smoothing: Width of the quadratic part of the loss.
+
+  Returns a tuple of:
+  - loss: Average data loss; a float, or an array of shape (M,).
+  - dS: Gradient of the loss with respect to S; same shape as S.
+  """
+  num_train = S.shape[0]
+  rows = np.arange(num_train)
+  correct_class_scores = S[rows, ..., y]
+  margins = S - correct_class_scores[..., np.newaxis] + 1 # note delta = 1
+  np.maximum(margins, 0, out=margins)
+  margins[rows, ..., y] = 0
+  quadratic = margins < smoothing
+  losses = np.where(quadratic, margins ** 2 / (2 * smoothing),
+                    margins - smoothing / 2.0)
+  loss = np.sum(losses, axis=(0, -1), dtype=np.float64) / num_train
+
+  dS = np.where(quadratic, margins / smoothing, 1.0)
+  dS[rows, ..., y] = -np.sum(dS, axis=-1)
+  dS /= num_train
+  return loss, dS
+
+
+def dot_into(A, B, out):
+  """
+  Matrix product A.dot(B) written to out, where A is a numpy array or a
+  scipy.sparse matrix and B a numpy array.
+
+  For a numpy A the product is computed in place; a sparse product cannot
+  write to a given array, so its result is copied into out.
+  """
+  if sparse.issparse(A):
+    out[...] = A.dot(B)
+  else:
+    np.dot(A, B, out=out)
+  return out
+
+
+class SVMLossWorkspace(object):
+  """
+  Structured SVM loss and gradient computed into preallocated buffers.
+
+  The score, margin and gradient buffers are allocated once per minibatch
+  shape and reused, and every step runs as an in-place ufunc, so after the
+  first call for a given shape a call allocates no arrays. The scores take
+  one GEMM and the gradient another.
+
+  Calling the workspace is equivalent to svm_loss_vectorized, except that the
+  returned gradient is a buffer that is overwritten by the next call. X may be
+  a scipy.sparse matrix, in which case the two products cost time in the
+  number of non-zeros of X.
+
+  The buffers have the datatype of W, and X is converted to it if needed;
+  the loss is accumulated in float64 either way.
+  """
+
+  def __init__(self):
+    self.buffers = {}
+
+  def _get(self, W, X):
+    key = (X.shape[0], W.shape, W.dtype)
+    if key not in self.buffers:
+      num_train, num_classes = X.shape[0], W.shape[1]
+      self.buffers[key] = {
+        'scores': np.empty((num_train, num_classes), dtype=W.dtype),
+        'correct': np.empty(num_train, dtype=W.dtype),
+        'counts': np.empty(num_train, dtype=W.dtype),
+        'row_offsets': np.arange(num_train) * num_classes,
+        'flat': np.empty(num_train, dtype=np.intp),
+        'dW': np.empty(W.shape, dtype=W.dtype),
+        'reg_dW': np.empty(W.shape, dtype=W.dtype),
+      }
+    return self.buffers[key]
+
+  def __call__(self, W, X, y, reg):
+    if X.dtype != W.dtype:
+      X = X.astype(W.dtype)
+    b = self._get(W, X)
+    num_train = X.shape[0]
+    S, flat = b['scores'], b['flat']
+    # Position of the correct class of each row in the flattened scores.
+    np.add(b['row_offsets'], y, out=flat)
+
+    dot_into(X, W, S)
+    np.take(S, flat, out=b['correct'])
+    # S becomes the margins max(0, s_j - s_y + 1), zero for the correct class.
+    S -= b['correct'][:, np.newaxis]
+    S += 1 # note delta = 1
+    np.maximum(S, 0, out=S)
+    np.put(S, flat, 0)
+    loss = S.sum(dtype=np.float64) / num_train
+    loss += reg * np.einsum('ij,ij->', W, W, dtype=np.float64)
+
+    # S becomes the gradient with respect to the scores.
+    np.sign(S, out=S)
+    np.sum(S, axis=1, out=b['counts'])
+    np.negative(b['counts'], out=b['counts'])
+    np.put(S, flat, b['counts'])
+    dW = b['dW']
+    dot_into(X.T, S, dW)
+    dW /= num_train
+    np.multiply(W, 2 * reg, out=b['reg_dW'])
+    dW += b['reg_dW']
+    return loss, dW
+
+
+def svm_dual_coordinate_descent(X, y, num_classes, reg, max_passes=50,
+                                tol=0.1, shrinking=True, seed=None,
+                                verbose=False):
+  """
+  One-vs-rest linear SVM trained by dual coordinate descent, as in LIBLINEAR
+  (Hsieh et al., "A Dual Coordinate Descent Method for Large-scale Linear
+  SVM", 2008).
+
+  Column c of W minimizes the binary hinge loss objective
+  reg * ||w_c||^2 + 1/N sum_i max(0, 1 - t_ic * w_c.x_i), where t_ic is +1
+  for y[i] == c and -1 otherwise. Every example has one dual variable per
+  class, bounded by 1 / (2 * reg * N); a step picks an example and updates
+  its dual variables for all classes in closed form, which takes the cached
+  squared norm of the row and two products with the row. Examples whose dual
+  variables all sit at a bound and are expected to stay there are shrunk
+  from the active set; once the rest has converged, the full set is checked
+  again.
+
+  Inputs:
+  - X: A numpy array or scipy.sparse matrix of shape (N, D) of data.
+  - y: A numpy array of shape (N,) of labels in 0...num_classes-1.
+  - num_classes: Number of classes C.
+  - reg: (float) regularization strength.
+  - max_passes: Maximum number of passes over the active examples.
+  - tol: Stop when the spread of the projected dual gradients over a pass is
+    below this.
+  - shrinking: Whether to shrink the active set.
+  - seed: Seed for the order in which examples are visited.
+  - verbose: If true, print the gap after every pass.
+
+  Returns a tuple of:
+  - W: A numpy array of shape (D, C) of weights.
+  - objectives: List of the primal objective after every pass.
+  """
+  rng = np.random.RandomState(seed)
+  num_train, dim = X.shape
+  upper = 1.0 / (2 * reg * num_train)
+  targets = np.where(y[:, np.newaxis] == np.arange(num_classes), 1.0, -1.0)
+  alpha = np.zeros((num_train, num_classes))
+  # The weights are kept as (C, D) so that a step only touches the rows of
+  # the classes whose dual variables moved.
+  W_t = np.zeros((num_classes, dim))
+  if sparse.issparse(X):
+    X = X.tocsr()
+    sq_norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+  else:
+    sq_norms = np.einsum('ij,ij->i', X, X)
+
+  def row(i):
+    if sparse.issparse(X):
+      lo, hi = X.indptr[i], X.indptr[i + 1]
+      return X.indices[lo:hi], X.data[lo:hi]
+    return slice(None), X[i]
+
+  # Rows of zeros do not move W and keep their dual variables at 0.
+  active = np.flatnonzero(sq_norms > 0)
+  pg_max_old = np.full(num_classes, np.inf)
+  pg_min_old = np.full(num_classes, -np.inf)
+  objectives = []
+  for p in xrange(max_passes):
+    rng.shuffle(active)
+    pg_max = np.full(num_classes, -np.inf)
+    pg_min = np.full(num_classes, np.inf)
+    keep = np.ones(active.shape[0], dtype=bool)
+    for n, i in enumerate(active):
+      cols, x = row(i)
+      t, a = targets[i], alpha[i]
+      grad = t * W_t[:, cols].dot(x) - 1
+      at_zero, at_upper = a == 0, a == upper
+      shrunk = (at_zero & (grad > pg_max_old)) | (at_upper & (grad < pg_min_old))
+      if shrinking and shrunk.all():
+        keep[n] = False
+        continue
+      proj_grad = np.where(at_zero, np.minimum(grad, 0),
+                           np.where(at_upper, np.maximum(grad, 0), grad))
+      proj_grad[shrunk] = 0
+      np.maximum(pg_max, proj_grad, out=pg_max)
+      np.minimum(pg_min, proj_grad, out=pg_min)
+
+      moved = np.flatnonzero(proj_grad)
+      if moved.size:
+        a_new = np.clip(a[moved] - grad[moved] / sq_norms[i], 0, upper)
+        step = (a_new - a[moved]) * t[moved]
+        a[moved] = a_new
+        if isinstance(cols, slice):
+          W_t[moved] += step[:, np.newaxis] * x
+        else:
+          W_t[moved[:, np.newaxis], cols] += step[:, np.newaxis] * x
+
+    margins = np.maximum(0, 1 - targets * X.dot(W_t.T))
+    objectives.append(reg * np.sum(W_t * W_t) + margins.sum() / num_train)
+    gap = np.max(pg_max - pg_min)
+    if verbose:
+      print('pass %d / %d: %d active, gap %f, objective %f' % (
+          p + 1, max_passes, active.shape[0], gap, objectives[-1]))
+    active = active[keep] if shrinking else active
+
+    if gap <= tol:
+      if active.shape[0] == np.count_nonzero(sq_norms > 0):
+        break
+      # Converged on the active set; check all examples once more.
+      active = np.flatnonzero(sq_norms > 0)
+      pg_max_old.fill(np.inf)
+      pg_min_old.fill(-np.inf)
+    else:
+      pg_max_old = np.where(pg_max <= 0, np.inf, pg_max)
+      pg_min_old = np.where(pg_min >= 0, -np.inf, pg_min)
+  return W_t.T.copy(), objectives
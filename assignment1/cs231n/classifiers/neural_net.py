@@ -3,6 +3,7 @@ from __future__ import print_function
 import numpy as np
 import matplotlib.pyplot as plt
 from past.builtins import xrange
+from cs231n.sampler import MinibatchSampler
 
 class TwoLayerNet(object):
   """
@@ -19,7 +20,8 @@ class TwoLayerNet(object):
   The outputs of the second fully-connected layer are the scores for each class.
   """
 
-  def __init__(self, input_size, hidden_size, output_size, std=1e-4):
+  def __init__(self, input_size, hidden_size, output_size, std=1e-4,
+               buffered=False, dtype=np.float64):
     """
     Initialize the model. Weights are initialized to small random values and
     biases are initialized to zero. Weights and biases are stored in the
@@ -34,12 +36,24 @@ class TwoLayerNet(object):
     - input_size: The dimension D of the input data.
     - hidden_size: The number of neurons H in the hidden layer.
     - output_size: The number of classes C.
+    - buffered: If true, loss computes the loss and gradients into buffers
+      that are allocated once per minibatch size and reused by later calls,
+      so that after the first iteration training allocates no arrays. The
+      returned gradients are then only valid until the next call to loss.
+    - dtype: numpy datatype of the parameters, activations and gradients,
+      e.g. np.float32 to halve their memory and speed up the products. Input
+      data of another datatype is converted batch by batch; losses are
+      accumulated in float64 either way.
     """
+    self.buffered = buffered
+    self.buffers = {}
     self.params = {}
-    self.params['W1'] = std * np.random.randn(input_size, hidden_size)
-    self.params['b1'] = np.zeros(hidden_size)
-    self.params['W2'] = std * np.random.randn(hidden_size, output_size)
-    self.params['b2'] = np.zeros(output_size)
+    self.params['W1'] = (std * np.random.randn(input_size, hidden_size)).astype(
+        dtype)
+    self.params['b1'] = np.zeros(hidden_size, dtype=dtype)
+    self.params['W2'] = (std * np.random.randn(hidden_size, output_size)).astype(
+        dtype)
+    self.params['b2'] = np.zeros(output_size, dtype=dtype)
 
   def loss(self, X, y=None, reg=0.0):
     """
@@ -64,6 +78,11 @@ class TwoLayerNet(object):
     - grads: Dictionary mapping parameter names to gradients of those parameters
       with respect to the loss function; has the same keys as self.params.
     """
+    if X.dtype != self.params['W1'].dtype:
+      X = X.astype(self.params['W1'].dtype)
+    if self.buffered and y is not None:
+      return self._loss_buffered(X, y, reg)
+
     # Unpack variables from the params dictionary
     W1, b1 = self.params['W1'], self.params['b1']
     W2, b2 = self.params['W2'], self.params['b2']
@@ -76,12 +95,8 @@ class TwoLayerNet(object):
     # Store the result in the scores variable, which should be an array of      #
     # shape (N, C).                                                             #
     #############################################################################
-    
-    scores = np.clip (np.dot(X,W1) + b1,0,None)
-    if(scores.shape != (N,W1.shape[1])):
-      print('score shape is not right')
-    scores = np.dot(scores,W2) + b2
-    
+    hidden = np.maximum(X.dot(W1) + b1, 0)
+    scores = hidden.dot(W2) + b2
     #############################################################################
     #                              END OF YOUR CODE                             #
     #############################################################################
@@ -98,38 +113,128 @@ class TwoLayerNet(object):
     # in the variable loss, which should be a scalar. Use the Softmax           #
     # classifier loss.                                                          #
     #############################################################################
-    scores = np.exp(scores) / np.sum(np.exp(scores),axis = 0)
-    widArray = range(0,N)
-
-    #This is cross-entropy loss for traning 
-    loss = -np.log(scores[widArray,y])
+    # Shift the scores so that the largest is zero for numeric stability.
+    shifted = scores - np.max(scores, axis=1, keepdims=True)
+    log_probs = shifted - np.log(np.sum(np.exp(shifted), axis=1, keepdims=True))
+    loss = -np.sum(log_probs[np.arange(N), y], dtype=np.float64) / N
+    loss += reg * (np.sum(W1 * W1, dtype=np.float64) +
+                   np.sum(W2 * W2, dtype=np.float64))
     #############################################################################
     #                              END OF YOUR CODE                             #
     #############################################################################
 
     # Backward pass: compute gradients
     grads = {}
-    dW1 = np.zero_like(W1)
-    db1 = np.zero_like(b1)
-    dW2 = np.zero_like(W2)
-    db2 = np.zero_like(b2)
     #############################################################################
     # TODO: Compute the backward pass, computing the derivatives of the weights #
     # and biases. Store the results in the grads dictionary. For example,       #
     # grads['W1'] should store the gradient on W1, and be a matrix of same size #
     #############################################################################
-    pass
-    
+    dscores = np.exp(log_probs)
+    dscores[np.arange(N), y] -= 1
+    dscores /= N
+    grads['W2'] = hidden.T.dot(dscores) + 2 * reg * W2
+    grads['b2'] = np.sum(dscores, axis=0)
+    dhidden = dscores.dot(W2.T)
+    dhidden[hidden <= 0] = 0
+    grads['W1'] = X.T.dot(dhidden) + 2 * reg * W1
+    grads['b1'] = np.sum(dhidden, axis=0)
     #############################################################################
     #                              END OF YOUR CODE                             #
     #############################################################################
 
     return loss, grads
 
+  def _get_buffers(self, N):
+    """
+    Buffers of the buffered loss for a minibatch of N examples, allocated on
+    the first call for N.
+    """
+    W1, W2 = self.params['W1'], self.params['W2']
+    key = (N, W1.shape, W2.shape, W1.dtype)
+    if key not in self.buffers:
+      (D, H), C = W1.shape, W2.shape[1]
+      dtype = W1.dtype
+      self.buffers[key] = {
+        'hidden': np.empty((N, H), dtype=dtype),
+        'active': np.empty((N, H), dtype=dtype),
+        'dhidden': np.empty((N, H), dtype=dtype),
+        'scores': np.empty((N, C), dtype=dtype),
+        'row_max': np.empty((N, 1), dtype=dtype),
+        'row_sum': np.empty((N, 1), dtype=dtype),
+        'correct': np.empty(N, dtype=dtype),
+        'row_offsets': np.arange(N) * C,
+        'flat': np.empty(N, dtype=np.intp),
+        'reg_W1': np.empty((D, H), dtype=dtype),
+        'reg_W2': np.empty((H, C), dtype=dtype),
+        'grads': {
+          'W1': np.empty((D, H), dtype=dtype),
+          'b1': np.empty(H, dtype=dtype),
+          'W2': np.empty((H, C), dtype=dtype),
+          'b2': np.empty(C, dtype=dtype),
+        },
+      }
+    return self.buffers[key]
+
+  def _loss_buffered(self, X, y, reg):
+    """
+    Same as loss with labels, computed with in-place ufuncs and products into
+    the buffers of _get_buffers. The returned grads dictionary and its arrays
+    are reused by the next call.
+    """
+    W1, b1 = self.params['W1'], self.params['b1']
+    W2, b2 = self.params['W2'], self.params['b2']
+    N = X.shape[0]
+    buf = self._get_buffers(N)
+    hidden, scores, grads = buf['hidden'], buf['scores'], buf['grads']
+    flat, correct = buf['flat'], buf['correct']
+
+    # Forward pass.
+    np.dot(X, W1, out=hidden)
+    hidden += b1
+    np.maximum(hidden, 0, out=hidden)
+    np.dot(hidden, W2, out=scores)
+    scores += b2
+
+    # Softmax loss, with the scores shifted so that the largest is zero.
+    np.add(buf['row_offsets'], y, out=flat)
+    np.max(scores, axis=1, out=buf['row_max'], keepdims=True)
+    scores -= buf['row_max']
+    np.take(scores, flat, out=correct)
+    np.exp(scores, out=scores)
+    np.sum(scores, axis=1, out=buf['row_sum'], keepdims=True)
+    np.log(buf['row_sum'], out=buf['row_max'])
+    loss = (buf['row_max'].sum(dtype=np.float64) -
+            correct.sum(dtype=np.float64)) / N
+    loss += reg * (np.einsum('ij,ij->', W1, W1, dtype=np.float64) +
+                   np.einsum('ij,ij->', W2, W2, dtype=np.float64))
+
+    # Backward pass; scores becomes the gradient with respect to the scores.
+    scores /= buf['row_sum']
+    np.take(scores, flat, out=correct)
+    correct -= 1
+    np.put(scores, flat, correct)
+    scores /= N
+    np.dot(hidden.T, scores, out=grads['W2'])
+    np.multiply(W2, 2 * reg, out=buf['reg_W2'])
+    grads['W2'] += buf['reg_W2']
+    np.sum(scores, axis=0, out=grads['b2'])
+
+    dhidden = buf['dhidden']
+    np.dot(scores, W2.T, out=dhidden)
+    # After the ReLU the sign is 1 for active units and 0 for the others.
+    np.sign(hidden, out=buf['active'])
+    np.multiply(dhidden, buf['active'], out=dhidden)
+    np.dot(X.T, dhidden, out=grads['W1'])
+    np.multiply(W1, 2 * reg, out=buf['reg_W1'])
+    grads['W1'] += buf['reg_W1']
+    np.sum(dhidden, axis=0, out=grads['b1'])
+    return loss, grads
+
   def train(self, X, y, X_val, y_val,
             learning_rate=1e-3, learning_rate_decay=0.95,
             reg=5e-6, num_iters=100,
-            batch_size=200, verbose=False):
+            batch_size=200, verbose=False, sampler_options=None):
     """
     Train this neural network using stochastic gradient descent.
 
@@ -146,6 +251,9 @@ class TwoLayerNet(object):
     - num_iters: Number of steps to take when optimizing.
     - batch_size: Number of training examples to use per step.
     - verbose: boolean; if true print progress during optimization.
+    - sampler_options: Optional dictionary of keyword arguments for
+      cs231n.sampler.MinibatchSampler (block_size, in_place, prefetch, seed),
+      which draws the minibatches from a once per epoch shuffle of the data.
     """
     num_train = X.shape[0]
     iterations_per_epoch = max(num_train / batch_size, 1)
@@ -155,6 +263,7 @@ class TwoLayerNet(object):
     train_acc_history = []
     val_acc_history = []
 
+    sampler = MinibatchSampler(X, y, batch_size, **(sampler_options or {}))
     for it in xrange(num_iters):
       X_batch = None
       y_batch = None
@@ -163,7 +272,7 @@ class TwoLayerNet(object):
       # TODO: Create a random minibatch of training data and labels, storing  #
       # them in X_batch and y_batch respectively.                             #
       #########################################################################
-      pass
+      X_batch, y_batch = sampler.next_batch()
       #########################################################################
       #                             END OF YOUR CODE                          #
       #########################################################################
@@ -178,7 +287,10 @@ class TwoLayerNet(object):
       # using stochastic gradient descent. You'll need to use the gradients   #
       # stored in the grads dictionary defined above.                         #
       #########################################################################
-      pass
+      for name in self.params:
+        # Scale the gradient in place so the update allocates nothing.
+        grads[name] *= learning_rate
+        self.params[name] -= grads[name]
       #########################################################################
       #                             END OF YOUR CODE                          #
       #########################################################################
@@ -223,7 +335,7 @@ class TwoLayerNet(object):
     ###########################################################################
     # TODO: Implement this function; it should be VERY simple!                #
     ###########################################################################
-    pass
+    y_pred = np.argmax(self.loss(X), axis=1)
     ###########################################################################
     #                              END OF YOUR CODE                           #
     ###########################################################################
@@ -1,6 +1,7 @@
 import numpy as np
 from random import shuffle
 from past.builtins import xrange
+from cs231n.classifiers.linear_svm import dot_into
 
 def softmax_loss_naive(W, X, y, reg):
   """
@@ -43,7 +44,8 @@ def softmax_loss_vectorized(W, X, y, reg):
   """
   Softmax loss function, vectorized version.
 
-  Inputs and outputs are the same as softmax_loss_naive.
+  Inputs and outputs are the same as softmax_loss_naive, except that X may
+  also be a scipy.sparse matrix.
   """
   # Initialize the loss and gradient to zero.
   loss = 0.0
@@ -55,10 +57,112 @@ def softmax_loss_vectorized(W, X, y, reg):
   # here, it is easy to run into numeric instability. Don't forget the        #
   # regularization!                                                           #
   #############################################################################
-  pass
+  scores = X.dot(W)
+  loss, dscores = softmax_loss_scores(scores, y)
+  loss += reg * np.sum(W * W, dtype=np.float64)
+  dW = X.T.dot(dscores)
+  dW += 2 * reg * W
   #############################################################################
   #                          END OF YOUR CODE                                 #
   #############################################################################
 
   return loss, dW
 
+
+
+def softmax_loss_scores(S, y):
+  """
+  Data part of the softmax loss computed from class scores, for one or
+  several models evaluated on the same minibatch.
+
+  Inputs:
+  - S: A numpy array of shape (N, C), or (N, M, C) for M models, of scores.
+  - y: A numpy array of shape (N,) containing training labels.
+
+  Returns a tuple of:
+  - loss: Average data loss; a float, or an array of shape (M,).
+  - dS: Gradient of the loss with respect to S; same shape as S.
+  """
+  num_train = S.shape[0]
+  rows = np.arange(num_train)
+  # Shift the scores so that the largest is zero for numeric stability.
+  shifted = S - np.max(S, axis=-1, keepdims=True)
+  log_probs = shifted - np.log(np.sum(np.exp(shifted), axis=-1, keepdims=True))
+  loss = -np.sum(log_probs[rows, ..., y], axis=0,
+                 dtype=np.float64) / num_train
+
+  dS = np.exp(log_probs)
+  dS[rows, ..., y] -= 1
+  dS /= num_train
+  return loss, dS
+
+
+class SoftmaxLossWorkspace(object):
+  """
+  Softmax loss and gradient computed into preallocated buffers.
+
+  The score and gradient buffers are allocated once per minibatch shape and
+  reused, and the max shift, exponentials and normalization all run in place
+  on the score buffer, so after the first call for a given shape a call
+  allocates no arrays.
+
+  Calling the workspace is equivalent to softmax_loss_vectorized, except that
+  the returned gradient is a buffer that is overwritten by the next call. X
+  may be a scipy.sparse matrix.
+
+  The buffers have the datatype of W, and X is converted to it if needed;
+  the loss is accumulated in float64 either way.
+  """
+
+  def __init__(self):
+    self.buffers = {}
+
+  def _get(self, W, X):
+    key = (X.shape[0], W.shape, W.dtype)
+    if key not in self.buffers:
+      num_train, num_classes = X.shape[0], W.shape[1]
+      self.buffers[key] = {
+        'scores': np.empty((num_train, num_classes), dtype=W.dtype),
+        'row_max': np.empty((num_train, 1), dtype=W.dtype),
+        'row_sum': np.empty((num_train, 1), dtype=W.dtype),
+        'correct': np.empty(num_train, dtype=W.dtype),
+        'row_offsets': np.arange(num_train) * num_classes,
+        'flat': np.empty(num_train, dtype=np.intp),
+        'dW': np.empty(W.shape, dtype=W.dtype),
+        'reg_dW': np.empty(W.shape, dtype=W.dtype),
+      }
+    return self.buffers[key]
+
+  def __call__(self, W, X, y, reg):
+    if X.dtype != W.dtype:
+      X = X.astype(W.dtype)
+    b = self._get(W, X)
+    num_train = X.shape[0]
+    S, flat, correct = b['scores'], b['flat'], b['correct']
+    # Position of the correct class of each row in the flattened scores.
+    np.add(b['row_offsets'], y, out=flat)
+
+    dot_into(X, W, S)
+    # Shift the scores so that the largest is zero for numeric stability.
+    np.max(S, axis=1, out=b['row_max'], keepdims=True)
+    S -= b['row_max']
+    np.take(S, flat, out=correct)
+    np.exp(S, out=S)
+    np.sum(S, axis=1, out=b['row_sum'], keepdims=True)
+    # -log p_y = log(sum_j exp(s_j)) - s_y, with the shifted scores.
+    np.log(b['row_sum'], out=b['row_max'])
+    loss = (b['row_max'].sum(dtype=np.float64) -
+            correct.sum(dtype=np.float64)) / num_train
+    loss += reg * np.einsum('ij,ij->', W, W, dtype=np.float64)
+
+    # S becomes the probabilities, then the gradient with respect to scores.
+    S /= b['row_sum']
+    np.take(S, flat, out=correct)
+    correct -= 1
+    np.put(S, flat, correct)
+    dW = b['dW']
+    dot_into(X.T, S, dW)
+    dW /= num_train
+    np.multiply(W, 2 * reg, out=b['reg_dW'])
+    dW += b['reg_dW']
+    return loss, dW
@@ -14,42 +14,104 @@ def load_pickle(f):
         return  pickle.load(f, encoding='latin1')
     raise ValueError("invalid python version: {}".format(version))
 
-def load_CIFAR_batch(filename):
-  """ load single batch of cifar """
+def load_CIFAR_batch(filename, dtype=np.float64):
+  """ load single batch of cifar, with images of the given numpy datatype """
   with open(filename, 'rb') as f:
     datadict = load_pickle(f)
     X = datadict['data']
     Y = datadict['labels']
-    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype("float")
+    X = X.reshape(10000, 3, 32, 32).transpose(0,2,3,1).astype(dtype)
     Y = np.array(Y)
     return X, Y
 
-def load_CIFAR10(ROOT):
-  """ load all of cifar """
+def load_CIFAR10(ROOT, dtype=np.float64):
+  """ load all of cifar, with images of the given numpy datatype """
   xs = []
   ys = []
   for b in range(1,6):
     f = os.path.join(ROOT, 'data_batch_%d' % (b, ))
-    X, Y = load_CIFAR_batch(f)
+    X, Y = load_CIFAR_batch(f, dtype)
     xs.append(X)
     ys.append(Y)    
   Xtr = np.concatenate(xs)
   Ytr = np.concatenate(ys)
   del X, Y
-  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'))
+  Xte, Yte = load_CIFAR_batch(os.path.join(ROOT, 'test_batch'), dtype)
   return Xtr, Ytr, Xte, Yte
 
 
+def cache_CIFAR10(ROOT, cache_dir, dtype=np.float64):
+  """
+  Write CIFAR-10 to .npy files one batch at a time, so the full training set
+  is never held in memory. The images are flattened to rows of length 3072
+  so the files can be memory mapped and passed straight to
+  KNearestNeighbor.train or np.load(..., mmap_mode='r').
+
+  Inputs:
+  - ROOT: Directory holding the pickled cifar-10-batches-py files.
+  - cache_dir: Directory to write X_train.npy, y_train.npy, X_test.npy and
+    y_test.npy to.
+  - dtype: numpy datatype of the cached images.
+
+  Returns: A dictionary mapping each of the four names to its file path.
+  """
+  if not os.path.isdir(cache_dir):
+    os.makedirs(cache_dir)
+  paths = dict((name, os.path.join(cache_dir, name + '.npy'))
+               for name in ('X_train', 'y_train', 'X_test', 'y_test'))
+  batches = [('train', os.path.join(ROOT, 'data_batch_%d' % b))
+             for b in range(1, 6)]
+  batches.append(('test', os.path.join(ROOT, 'test_batch')))
+  X_out = {
+    'train': np.lib.format.open_memmap(paths['X_train'], mode='w+',
+                                       dtype=dtype, shape=(50000, 3072)),
+    'test': np.lib.format.open_memmap(paths['X_test'], mode='w+',
+                                      dtype=dtype, shape=(10000, 3072)),
+  }
+  ys = {'train': [], 'test': []}
+  offsets = {'train': 0, 'test': 0}
+  for split, filename in batches:
+    X, Y = load_CIFAR_batch(filename, dtype)
+    lo = offsets[split]
+    X_out[split][lo:lo + X.shape[0]] = X.reshape(X.shape[0], -1)
+    offsets[split] = lo + X.shape[0]
+    ys[split].append(Y)
+  for split in ('train', 'test'):
+    X_out[split].flush()
+    np.save(paths['y_' + split], np.concatenate(ys[split]))
+  del X_out
+  return paths
+
+
+def iter_CIFAR10_batches(ROOT, batches=(1, 2, 3, 4, 5), dtype=np.float64):
+  """
+  Yield the CIFAR-10 training batches one file at a time, for training
+  without loading the whole dataset, e.g. with
+  LinearClassifier.train_stream(lambda: iter_CIFAR10_batches(ROOT)).
+
+  Inputs:
+  - ROOT: Directory holding the pickled cifar-10-batches-py files.
+  - batches: Numbers of the data_batch files to read, in order.
+  - dtype: numpy datatype of the yielded images.
+
+  Yields: Tuples (X, y) of 10000 images flattened to rows of length 3072 and
+  their labels.
+  """
+  for b in batches:
+    X, Y = load_CIFAR_batch(os.path.join(ROOT, 'data_batch_%d' % b), dtype)
+    yield X.reshape(X.shape[0], -1), Y
+
+
 def get_CIFAR10_data(num_training=49000, num_validation=1000, num_test=1000,
-                     subtract_mean=True):
+                     subtract_mean=True, dtype=np.float64):
     """
     Load the CIFAR-10 dataset from disk and perform preprocessing to prepare
     it for classifiers. These are the same steps as we used for the SVM, but
-    condensed to a single function.
+    condensed to a single function. The images have the numpy datatype dtype.
     """
     # Load the raw CIFAR-10 data
     cifar10_dir = 'cs231n/datasets/cifar-10-batches-py'
-    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir)
+    X_train, y_train, X_test, y_test = load_CIFAR10(cifar10_dir, dtype)
         
     # Subsample the data
     mask = list(range(num_training, num_training + num_validation))
@@ -0,0 +1,725 @@
+"""
+Index structures used by cs231n.classifiers.KNearestNeighbor to answer
+nearest neighbor queries without scanning the whole training set.
+
+Every index is built from the training matrix and exposes
+
+  query(X, k) -> (dists, neighbors)
+
+where dists has shape (num_test, k) and holds Euclidean distances in
+increasing order and neighbors holds the matching row indices into the
+training matrix.
+"""
+from __future__ import print_function
+from past.builtins import xrange
+
+import heapq
+import math
+
+import numpy as np
+
+
+def merge_topk(best_d, best_i, tile, ids, k):
+  """
+  Merge a tile of squared distances into the running top-k of each row.
+
+  Inputs:
+  - best_d, best_i: Arrays of shape (rows, k) with the current k smallest
+    squared distances and their training indices (in no particular order).
+  - tile: Array of shape (rows, cols) of squared distances for a new block.
+  - ids: Array of shape (cols,) giving the training index of each column.
+  - k: Number of neighbors to keep.
+
+  Returns a tuple (best_d, best_i) of the merged top-k arrays.
+  """
+  cand_d = np.hstack((best_d, tile))
+  cand_i = np.hstack((best_i, np.broadcast_to(ids, tile.shape)))
+  part = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+  return (np.take_along_axis(cand_d, part, axis=1),
+          np.take_along_axis(cand_i, part, axis=1))
+
+
+def sort_topk(best_d, best_i, squared=True):
+  """
+  Sort the running top-k of each row by distance. Negative round-off is
+  clipped to zero and, if squared is true, the squared distances are turned
+  into Euclidean distances.
+  """
+  order = np.argsort(best_d, axis=1)
+  best_d = np.take_along_axis(best_d, order, axis=1)
+  best_i = np.take_along_axis(best_i, order, axis=1)
+  np.maximum(best_d, 0, out=best_d)
+  if squared:
+    np.sqrt(best_d, out=best_d)
+  return best_d, best_i
+
+
+def sq_distances(X, Y, Y_sq_norms=None):
+  """
+  Squared Euclidean distances between the rows of X and the rows of Y using
+  ||x||^2 + ||y||^2 - 2xy, so the bulk of the work is a single GEMM.
+  """
+  if Y_sq_norms is None:
+    Y_sq_norms = np.sum(Y * Y, axis=1)
+  d = np.dot(X, Y.T)
+  d *= -2
+  d += np.sum(X * X, axis=1)[:, np.newaxis]
+  d += Y_sq_norms
+  return d
+
+
+def l1_distances(X, Y, max_elems=2 ** 18):
+  """
+  L1 distances between the rows of X and the rows of Y.
+
+  The broadcast difference is only ever formed for a group of rows of X and
+  a block of dimensions at a time, holding at most max_elems entries, so the
+  full (N, M, D) tensor is never built and the temporaries stay in cache.
+  """
+  num_x, dim = X.shape
+  num_y = Y.shape[0]
+  dists = np.zeros((num_x, num_y))
+  dim_block = max(1, min(dim, 64, max_elems // max(num_y, 1)))
+  rows = max(1, max_elems // (num_y * dim_block))
+  for d in xrange(0, dim, dim_block):
+    Y_block = Y[:, d:d + dim_block]
+    for lo in xrange(0, num_x, rows):
+      diff = X[lo:lo + rows, np.newaxis, d:d + dim_block] - Y_block
+      np.abs(diff, out=diff)
+      dists[lo:lo + rows] += diff.sum(axis=2)
+  return dists
+
+
+class _SpaceTree(object):
+  """
+  Base class of the binary space partitioning trees. Subclasses decide how a
+  node is split and how a lower bound on the distance from a query to any
+  point inside a node is computed.
+
+  Points are stored reordered so that every node owns a contiguous slice
+  [start, end) of self.X, which keeps the leaf scans cache friendly.
+  """
+
+  def __init__(self, X, leaf_size=40):
+    """
+    Inputs:
+    - X: A numpy array of shape (num_train, D) containing the points to index.
+    - leaf_size: Nodes with at most this many points are not split further.
+    """
+    self.leaf_size = leaf_size
+    self.order = np.arange(X.shape[0])
+    self._X = X
+    self.start, self.end, self.left, self.right = [], [], [], []
+    self._init_bounds()
+    self._build(0, X.shape[0])
+    self.start = np.array(self.start)
+    self.end = np.array(self.end)
+    self.left = np.array(self.left)
+    self.right = np.array(self.right)
+    self._finish_bounds()
+    del self._X
+    self.X = X[self.order]
+    self.sq_norms = np.sum(self.X * self.X, axis=1)
+
+  def _build(self, lo, hi):
+    node = len(self.start)
+    self.start.append(lo)
+    self.end.append(hi)
+    self.left.append(-1)
+    self.right.append(-1)
+    points = self._X[self.order[lo:hi]]
+    self._add_bounds(points)
+    if hi - lo > self.leaf_size:
+      mid = self._split(points, lo, hi)
+      self.left[node] = self._build(lo, mid)
+      self.right[node] = self._build(mid, hi)
+    return node
+
+  def _split_at_median(self, values, lo, hi):
+    """
+    Reorder self.order[lo:hi] so that the points with the smaller half of
+    values come first, and return the split position.
+    """
+    half = (hi - lo) // 2
+    part = np.argpartition(values, half)
+    self.order[lo:hi] = self.order[lo:hi][part]
+    return lo + half
+
+  def query(self, X, k=1):
+    """
+    Exact k nearest neighbor search with branch-and-bound pruning.
+
+    All queries descend the tree together: at every node the queries whose
+    lower bound already exceeds their current k-th best distance are dropped,
+    and the remaining ones visit the closer child first.
+
+    Inputs:
+    - X: A numpy array of shape (num_test, D) containing the queries.
+    - k: The number of neighbors to return.
+
+    Returns a tuple of:
+    - dists: Array of shape (num_test, k) of distances in increasing order.
+    - neighbors: Array of shape (num_test, k) of indices of the neighbors.
+    """
+    num_test = X.shape[0]
+    k = min(k, self.X.shape[0])
+    self._best_d = np.full((num_test, k), np.inf)
+    self._best_i = np.zeros((num_test, k), dtype=np.int64)
+    self._search(0, X, np.arange(num_test), np.zeros(num_test), k)
+    best_d, best_i = self._best_d, self._best_i
+    del self._best_d, self._best_i
+    return sort_topk(best_d, best_i)
+
+  def _search(self, node, X, qidx, lb, k):
+    # The running top-k is unordered, so its maximum is the k-th best.
+    keep = lb < self._best_d[qidx].max(axis=1)
+    qidx = qidx[keep]
+    if qidx.shape[0] == 0:
+      return
+    lo, hi = self.start[node], self.end[node]
+    left, right = self.left[node], self.right[node]
+    if left < 0:
+      tile = sq_distances(X[qidx], self.X[lo:hi], self.sq_norms[lo:hi])
+      self._best_d[qidx], self._best_i[qidx] = merge_topk(
+          self._best_d[qidx], self._best_i[qidx], tile, self.order[lo:hi], k)
+      return
+    Q = X[qidx]
+    lb_left = self._lower_bound(left, Q)
+    lb_right = self._lower_bound(right, Q)
+    near_left = lb_left <= lb_right
+    far = ~near_left
+    # Closer child first for every query, then the farther one, which by then
+    # has a tighter k-th best distance to prune against.
+    self._search(left, X, qidx[near_left], lb_left[near_left], k)
+    self._search(right, X, qidx[far], lb_right[far], k)
+    self._search(right, X, qidx[near_left], lb_right[near_left], k)
+    self._search(left, X, qidx[far], lb_left[far], k)
+
+
+class KDTree(_SpaceTree):
+  """
+  KD-tree with axis aligned bounding boxes. Each node is split at the median
+  of its widest dimension. Works best for low dimensional inputs such as
+  color histograms or other compact features.
+  """
+
+  def _init_bounds(self):
+    self.box_lo, self.box_hi = [], []
+
+  def _add_bounds(self, points):
+    self.box_lo.append(points.min(axis=0))
+    self.box_hi.append(points.max(axis=0))
+
+  def _finish_bounds(self):
+    self.box_lo = np.array(self.box_lo)
+    self.box_hi = np.array(self.box_hi)
+
+  def _split(self, points, lo, hi):
+    node = len(self.box_lo) - 1
+    dim = np.argmax(self.box_hi[node] - self.box_lo[node])
+    return self._split_at_median(points[:, dim], lo, hi)
+
+  def _lower_bound(self, node, Q):
+    diff = np.maximum(self.box_lo[node] - Q, 0)
+    diff += np.maximum(Q - self.box_hi[node], 0)
+    return np.sum(diff * diff, axis=1)
+
+
+class BallTree(_SpaceTree):
+  """
+  Ball tree with a centroid and radius per node. Each node is split along the
+  direction joining two far apart points, which adapts to the intrinsic
+  dimension of the data and keeps pruning effective in higher dimensions.
+  """
+
+  def _init_bounds(self):
+    self.center, self.radius = [], []
+
+  def _add_bounds(self, points):
+    center = points.mean(axis=0)
+    diff = points - center
+    self.center.append(center)
+    self.radius.append(np.sqrt(np.max(np.sum(diff * diff, axis=1))))
+
+  def _finish_bounds(self):
+    self.center = np.array(self.center)
+    self.radius = np.array(self.radius)
+
+  def _split(self, points, lo, hi):
+    node = len(self.center) - 1
+    a = points[np.argmax(np.sum((points - self.center[node]) ** 2, axis=1))]
+    b = points[np.argmax(np.sum((points - a) ** 2, axis=1))]
+    return self._split_at_median(points.dot(b - a), lo, hi)
+
+  def _lower_bound(self, node, Q):
+    diff = Q - self.center[node]
+    dist = np.sqrt(np.sum(diff * diff, axis=1)) - self.radius[node]
+    np.maximum(dist, 0, out=dist)
+    return dist * dist
+
+
+def build_tree(X, kind='auto', leaf_size=40, max_kd_dim=20):
+  """
+  Build a tree index over the rows of X.
+
+  Inputs:
+  - X: A numpy array of shape (num_train, D).
+  - kind: 'kd', 'ball' or 'auto'. 'auto' picks a KD-tree when D is at most
+    max_kd_dim and a ball tree otherwise; axis aligned boxes stop pruning
+    well once the dimension grows.
+  - leaf_size: Maximum number of points in a leaf.
+
+  Returns: A KDTree or BallTree instance.
+  """
+  if kind == 'auto':
+    kind = 'kd' if X.shape[1] <= max_kd_dim else 'ball'
+  if kind == 'kd':
+    return KDTree(X, leaf_size=leaf_size)
+  elif kind == 'ball':
+    return BallTree(X, leaf_size=leaf_size)
+  raise ValueError('Invalid tree kind "%s"' % kind)
+
+
+class LSHIndex(object):
+  """
+  Approximate nearest neighbor index based on random projection (sign)
+  locality sensitive hashing.
+
+  Each of num_tables hash tables maps a point to num_bits sign bits of random
+  projections of the centered data. A query only computes exact distances to
+  the points that share a bucket with it in at least one table. More tables
+  raise recall, more bits make buckets smaller and queries faster.
+  """
+
+  def __init__(self, X, num_tables=8, num_bits=12, seed=0):
+    """
+    Inputs:
+    - X: A numpy array of shape (num_train, D) containing the points to index.
+    - num_tables: Number of independent hash tables.
+    - num_bits: Number of hyperplanes (bits) per table; at most 62.
+    - seed: Seed for the random hyperplanes.
+    """
+    if not 0 < num_bits <= 62:
+      raise ValueError('num_bits must be between 1 and 62')
+    rng = np.random.RandomState(seed)
+    self.num_tables = num_tables
+    self.num_bits = num_bits
+    self.X = X
+    self.sq_norms = np.sum(X * X, axis=1)
+    self.mean = X.mean(axis=0)
+    self.planes = rng.randn(X.shape[1], num_tables * num_bits)
+    self.bit_values = 1 << np.arange(num_bits, dtype=np.int64)
+
+    # Each table is stored as the training ids sorted by bucket code, so a
+    # bucket is a contiguous range found with a binary search.
+    codes = self._hash(X)
+    self.sorted_ids = np.argsort(codes, axis=0, kind='mergesort').T
+    self.sorted_codes = np.take_along_axis(codes, self.sorted_ids.T, axis=0).T
+    self.mean_candidates = 0.0
+
+  def _hash(self, X):
+    bits = np.dot(X - self.mean, self.planes) > 0
+    bits = bits.reshape(X.shape[0], self.num_tables, self.num_bits)
+    return np.dot(bits, self.bit_values)
+
+  def candidates(self, X):
+    """
+    Return a list with, for every row of X, the array of training ids that
+    share a bucket with it in any table.
+    """
+    codes = self._hash(X)
+    starts = np.empty(codes.shape, dtype=np.int64)
+    ends = np.empty(codes.shape, dtype=np.int64)
+    for t in xrange(self.num_tables):
+      starts[:, t] = np.searchsorted(self.sorted_codes[t], codes[:, t], 'left')
+      ends[:, t] = np.searchsorted(self.sorted_codes[t], codes[:, t], 'right')
+    result = []
+    for i in xrange(X.shape[0]):
+      buckets = [self.sorted_ids[t, starts[i, t]:ends[i, t]]
+                 for t in xrange(self.num_tables)]
+      result.append(np.unique(np.concatenate(buckets)))
+    return result
+
+  def query(self, X, k=1):
+    """
+    Approximate k nearest neighbor search over the candidate buckets.
+
+    Queries with fewer than k candidates fall back to a full scan, so k
+    neighbors are always returned.
+
+    Inputs and outputs are the same as _SpaceTree.query. After the call,
+    self.mean_candidates holds the average number of distances computed per
+    query.
+    """
+    num_test = X.shape[0]
+    k = min(k, self.X.shape[0])
+    best_d = np.empty((num_test, k))
+    best_i = np.empty((num_test, k), dtype=np.int64)
+    total = 0
+    for i, cand in enumerate(self.candidates(X)):
+      if cand.shape[0] < k:
+        cand = np.arange(self.X.shape[0])
+      total += cand.shape[0]
+      d = self.sq_norms[cand] - 2 * np.dot(self.X[cand], X[i])
+      part = np.argpartition(d, k - 1)[:k]
+      best_d[i] = d[part] + np.dot(X[i], X[i])
+      best_i[i] = cand[part]
+    self.mean_candidates = total / float(max(num_test, 1))
+    return sort_topk(best_d, best_i)
+
+
+class HNSWIndex(object):
+  """
+  Approximate nearest neighbor index based on a hierarchical navigable small
+  world graph (Malkov and Yashunin, 2016).
+
+  Points are inserted one at a time. Every point gets a random top level and
+  is linked to (at most) M neighbors on each level up to it, 2 * M on the
+  bottom level. A query greedily descends the sparse upper levels and then
+  runs a best-first search with a beam of ef_search points on the bottom
+  level, so it only computes distances to a small part of the data.
+  """
+
+  def __init__(self, X, M=16, ef_construction=100, ef_search=50, seed=0):
+    """
+    Inputs:
+    - X: A numpy array of shape (num_train, D) containing the points to index.
+      More points can be added later with add.
+    - M: Number of links per point on the upper levels.
+    - ef_construction: Beam width used to find neighbors while inserting.
+    - ef_search: Default beam width used by query; larger is slower and more
+      accurate.
+    - seed: Seed for the random level assignment.
+    """
+    self.M = M
+    self.ef_construction = ef_construction
+    self.ef_search = ef_search
+    self.seed = seed
+    self.rng = np.random.RandomState(seed)
+    self.level_mult = 1 / math.log(M)
+    self.count = 0
+    self._data = np.empty((0, X.shape[1]), dtype=X.dtype)
+    self._sq_norms = np.empty(0, dtype=X.dtype)
+    self.node_level = []
+    # links[l][i] is the list of neighbors of point i on level l.
+    self.links = []
+    self.entry = -1
+    self.add(X)
+
+  @property
+  def X(self):
+    return self._data[:self.count]
+
+  def add(self, X):
+    """
+    Insert the rows of X into the graph. They get the ids
+    self.count, ..., self.count + X.shape[0] - 1.
+    """
+    needed = self.count + X.shape[0]
+    if needed > self._data.shape[0]:
+      capacity = max(needed, 2 * self._data.shape[0])
+      data = np.empty((capacity, X.shape[1]), dtype=self._data.dtype)
+      data[:self.count] = self._data[:self.count]
+      sq_norms = np.empty(capacity, dtype=self._data.dtype)
+      sq_norms[:self.count] = self._sq_norms[:self.count]
+      self._data, self._sq_norms = data, sq_norms
+    self._data[self.count:needed] = X
+    self._sq_norms[self.count:needed] = np.sum(X * X, axis=1)
+    for i in xrange(self.count, needed):
+      self.count = i + 1
+      self._insert(i)
+
+  def _insert(self, i):
+    level = int(-math.log(1 - self.rng.rand()) * self.level_mult)
+    self.node_level.append(level)
+    while len(self.links) <= level:
+      self.links.append({})
+    for l in xrange(level + 1):
+      self.links[l][i] = []
+    if self.entry < 0:
+      self.entry = i
+      return
+
+    q, q_sq = self._data[i], self._sq_norms[i]
+    top = self.node_level[self.entry]
+    eps = [(self._dist(q, q_sq, [self.entry])[0], self.entry)]
+    for l in xrange(top, level, -1):
+      eps = self._search_layer(q, q_sq, eps, 1, l)
+    for l in xrange(min(level, top), -1, -1):
+      eps = self._search_layer(q, q_sq, eps, self.ef_construction, l)
+      neighbors = self._select(eps, self.M)
+      self.links[l][i] = neighbors
+      max_links = 2 * self.M if l == 0 else self.M
+      for n in neighbors:
+        links = self.links[l][n]
+        links.append(i)
+        if len(links) > max_links:
+          d = self._dist(self._data[n], self._sq_norms[n], links)
+          self.links[l][n] = self._select(sorted(zip(d.tolist(), links)),
+                                          max_links)
+    if level > top:
+      self.entry = i
+
+  def _dist(self, q, q_sq, ids):
+    ids = np.asarray(ids)
+    return self._sq_norms[ids] - 2 * np.dot(self._data[ids], q) + q_sq
+
+  def _search_layer(self, q, q_sq, eps, ef, level):
+    """
+    Best-first search on one level starting from the (distance, id) pairs in
+    eps. Returns up to ef (distance, id) pairs sorted by distance.
+    """
+    links = self.links[level]
+    visited = set(n for _, n in eps)
+    candidates = list(eps)
+    heapq.heapify(candidates)
+    results = [(-d, n) for d, n in eps]
+    heapq.heapify(results)
+    while len(results) > ef:
+      heapq.heappop(results)
+    while candidates:
+      d, c = heapq.heappop(candidates)
+      if d > -results[0][0]:
+        break
+      new = [n for n in links[c] if n not in visited]
+      if not new:
+        continue
+      visited.update(new)
+      worst = -results[0][0]
+      for dn, n in zip(self._dist(q, q_sq, new).tolist(), new):
+        if len(results) < ef or dn < worst:
+          heapq.heappush(candidates, (dn, n))
+          heapq.heappush(results, (-dn, n))
+          if len(results) > ef:
+            heapq.heappop(results)
+          worst = -results[0][0]
+    return sorted((-d, n) for d, n in results)
+
+  def _select(self, candidates, M):
+    """
+    Neighbor selection heuristic: walk the (distance, id) candidates from the
+    closest and keep a point only if it is closer to the new point than to
+    every point kept so far, which spreads links in different directions.
+    Remaining slots are filled with the closest skipped candidates.
+    """
+    if len(candidates) <= M:
+      return [n for _, n in candidates]
+    d = np.array([c[0] for c in candidates])
+    ids = np.array([c[1] for c in candidates])
+    pair = sq_distances(self._data[ids], self._data[ids], self._sq_norms[ids])
+    # blocked[j][r]: candidate j is at least as close to r as to the new point
+    blocked = (pair <= d[:, np.newaxis]).tolist()
+    kept, skipped = [], []
+    for j in xrange(len(ids)):
+      row = blocked[j]
+      if not any(row[r] for r in kept):
+        kept.append(j)
+        if len(kept) == M:
+          break
+      else:
+        skipped.append(j)
+    kept.extend(skipped[:M - len(kept)])
+    return ids[kept].tolist()
+
+  def query(self, X, k=1, ef=None):
+    """
+    Approximate k nearest neighbor search.
+
+    Inputs:
+    - X: A numpy array of shape (num_test, D) containing the queries.
+    - k: The number of neighbors to return.
+    - ef: Beam width on the bottom level; defaults to self.ef_search and is
+      never smaller than k.
+
+    Returns: Same as _SpaceTree.query.
+    """
+    num_test = X.shape[0]
+    k = min(k, self.count)
+    ef = max(ef or self.ef_search, k)
+    best_d = np.empty((num_test, k))
+    best_i = np.empty((num_test, k), dtype=np.int64)
+    for i in xrange(num_test):
+      q = X[i]
+      q_sq = np.dot(q, q)
+      eps = [(self._dist(q, q_sq, [self.entry])[0], self.entry)]
+      for l in xrange(self.node_level[self.entry], 0, -1):
+        eps = self._search_layer(q, q_sq, eps, 1, l)
+      eps = self._search_layer(q, q_sq, eps, ef, 0)[:k]
+      best_d[i] = [d for d, _ in eps]
+      best_i[i] = [n for _, n in eps]
+    np.maximum(best_d, 0, out=best_d)
+    return np.sqrt(best_d), best_i
+
+  def save(self, path):
+    """
+    Write the graph (not the indexed vectors) to an .npz file so that a
+    serving process can load it instead of rebuilding it.
+    """
+    arrays = {
+      'params': np.array([self.M, self.ef_construction, self.ef_search,
+                          self.seed, self.entry, self.count]),
+      'node_level': np.array(self.node_level, dtype=np.int64),
+    }
+    for l, links in enumerate(self.links):
+      nodes = sorted(links)
+      arrays['nodes_%d' % l] = np.array(nodes, dtype=np.int64)
+      arrays['offsets_%d' % l] = np.cumsum(
+          [0] + [len(links[n]) for n in nodes]).astype(np.int64)
+      arrays['neighbors_%d' % l] = np.array(
+          [m for n in nodes for m in links[n]], dtype=np.int64)
+    np.savez(path, **arrays)
+
+  @classmethod
+  def load(cls, path, X):
+    """
+    Load a graph written by save.
+
+    Inputs:
+    - path: File written by save.
+    - X: The same points, in the same order, that the graph was built from.
+
+    Returns: An HNSWIndex instance.
+    """
+    with np.load(path) as f:
+      M, ef_construction, ef_search, seed, entry, count = f['params'].tolist()
+      if X.shape[0] != count:
+        raise ValueError('Graph was built over %d points but X has %d rows'
+                         % (count, X.shape[0]))
+      index = cls(X[:0], M=M, ef_construction=ef_construction,
+                  ef_search=ef_search, seed=seed)
+      index.node_level = f['node_level'].tolist()
+      for l in xrange(max(index.node_level) + 1 if count else 0):
+        nodes = f['nodes_%d' % l].tolist()
+        offsets = f['offsets_%d' % l]
+        neighbors = f['neighbors_%d' % l].tolist()
+        index.links.append(dict(
+            (n, neighbors[offsets[j]:offsets[j + 1]])
+            for j, n in enumerate(nodes)))
+    index.entry = entry
+    index.count = count
+    index._data = X
+    index._sq_norms = np.sum(X * X, axis=1)
+    # Points added after loading draw fresh levels.
+    index.rng = np.random.RandomState(seed + count)
+    return index
+
+
+def kmeans(X, num_clusters, num_iters=20, rng=np.random):
+  """
+  Plain Lloyd's k-means.
+
+  Inputs:
+  - X: A numpy array of shape (N, D).
+  - num_clusters: Number of centroids; must not exceed N.
+  - num_iters: Number of assignment / update rounds.
+  - rng: Random state used to pick the initial centroids.
+
+  Returns a tuple of:
+  - centroids: Array of shape (num_clusters, D).
+  - assign: Array of shape (N,) giving the centroid of every row of X.
+  """
+  centroids = X[rng.choice(X.shape[0], num_clusters, replace=False)].copy()
+  for it in xrange(num_iters):
+    assign = np.argmin(sq_distances(X, centroids), axis=1)
+    counts = np.bincount(assign, minlength=num_clusters)
+    sums = np.empty_like(centroids)
+    for d in xrange(X.shape[1]):
+      sums[:, d] = np.bincount(assign, weights=X[:, d], minlength=num_clusters)
+    nonempty = counts > 0
+    # Empty clusters keep their previous centroid.
+    centroids[nonempty] = sums[nonempty] / counts[nonempty, np.newaxis]
+  assign = np.argmin(sq_distances(X, centroids), axis=1)
+  return centroids, assign
+
+
+class PQIndex(object):
+  """
+  Product quantization index (Jegou et al., 2011).
+
+  The dimensions are split into num_subspaces groups and every group of every
+  training vector is replaced by the id of its nearest centroid in a small
+  per group codebook, so a vector is stored in num_subspaces bytes. Query
+  distances are computed asymmetrically: the query is kept exact and the
+  distance to each training vector is a sum of per group lookups into a table
+  of query to centroid distances. Optionally the best candidates are
+  re-ranked with exact distances.
+  """
+
+  def __init__(self, X, num_subspaces=8, num_centroids=256, num_iters=20,
+               rerank=0, sample_size=20000, block_size=256, seed=0):
+    """
+    Inputs:
+    - X: A numpy array of shape (num_train, D) containing the points to index.
+    - num_subspaces: Number of groups the dimensions are split into; this is
+      the number of bytes per encoded vector.
+    - num_centroids: Codebook size per group, at most 256.
+    - num_iters: k-means iterations used to learn each codebook.
+    - rerank: If positive, compute exact distances for this many of the best
+      approximate candidates. This keeps a reference to X, so the raw data
+      has to stay available.
+    - sample_size: Number of training rows used to learn the codebooks.
+    - block_size: Number of queries whose distance tables are processed
+      together.
+    - seed: Seed for the codebook initialization and the training sample.
+    """
+    if not 0 < num_centroids <= 256:
+      raise ValueError('num_centroids must be between 1 and 256')
+    rng = np.random.RandomState(seed)
+    num_train = X.shape[0]
+    num_centroids = min(num_centroids, num_train)
+    self.rerank = rerank
+    self.block_size = block_size
+    self.num_train = num_train
+    self.groups = np.array_split(np.arange(X.shape[1]), num_subspaces)
+    sample = X
+    if num_train > sample_size:
+      sample = X[np.sort(rng.choice(num_train, sample_size, replace=False))]
+
+    self.codebooks = []
+    # Column major so that the per group lookups read contiguous codes.
+    self.codes = np.empty((num_train, num_subspaces), dtype=np.uint8,
+                          order='F')
+    for j, dims in enumerate(self.groups):
+      centroids, _ = kmeans(sample[:, dims], num_centroids, num_iters, rng)
+      self.codebooks.append(centroids)
+      for lo in xrange(0, num_train, 4096):
+        chunk = X[lo:lo + 4096, dims]
+        self.codes[lo:lo + 4096, j] = np.argmin(
+            sq_distances(chunk, centroids), axis=1)
+    self.X = X if rerank > 0 else None
+    self.sq_norms = np.sum(X * X, axis=1) if rerank > 0 else None
+
+  @property
+  def nbytes(self):
+    """ Bytes used by the codes and codebooks. """
+    return self.codes.nbytes + sum(c.nbytes for c in self.codebooks)
+
+  def query(self, X, k=1):
+    """
+    Approximate k nearest neighbor search with asymmetric distance lookups,
+    followed by exact re-ranking when self.rerank is positive.
+
+    Inputs and outputs are the same as _SpaceTree.query; without re-ranking
+    the returned distances are the approximate ones.
+    """
+    num_test = X.shape[0]
+    k = min(k, self.num_train)
+    num_cand = min(max(k, self.rerank), self.num_train)
+    best_d = np.empty((num_test, k))
+    best_i = np.empty((num_test, k), dtype=np.int64)
+    for lo in xrange(0, num_test, self.block_size):
+      Q = X[lo:lo + self.block_size]
+      d = np.zeros((Q.shape[0], self.num_train))
+      for j, dims in enumerate(self.groups):
+        table = sq_distances(Q[:, dims], self.codebooks[j])
+        d += table[:, self.codes[:, j]]
+      cand = np.argpartition(d, num_cand - 1, axis=1)[:, :num_cand]
+      if self.rerank > 0:
+        for i in xrange(Q.shape[0]):
+          exact = self.sq_norms[cand[i]] - 2 * np.dot(self.X[cand[i]], Q[i])
+          d[i, cand[i]] = exact + np.dot(Q[i], Q[i])
+      cand_d = np.take_along_axis(d, cand, axis=1)
+      part = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+      best_d[lo:lo + Q.shape[0]] = np.take_along_axis(cand_d, part, axis=1)
+      best_i[lo:lo + Q.shape[0]] = np.take_along_axis(cand, part, axis=1)
+    return sort_topk(best_d, best_i)
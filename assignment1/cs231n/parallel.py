@@ -0,0 +1,174 @@
+"""
+Helpers for sharing read-only numpy arrays with worker processes through
+multiprocessing.shared_memory, so that a pool does not pickle or copy large
+training sets into every worker, and a process pool grid search built on
+them.
+"""
+from __future__ import print_function
+
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def resolve_n_jobs(n_jobs):
+  """ Turn n_jobs (a positive count, or -1 for all cores) into a count. """
+  if n_jobs is None or n_jobs == 0:
+    return 1
+  if n_jobs < 0:
+    return max(1, (os.cpu_count() or 1) + 1 + n_jobs)
+  return n_jobs
+
+
+def share_arrays(arrays):
+  """
+  Copy arrays into new shared memory blocks.
+
+  Inputs:
+  - arrays: Dictionary mapping names to numpy arrays.
+
+  Returns a tuple of:
+  - blocks: List of SharedMemory objects; pass it to release_arrays when the
+    workers are done.
+  - specs: Picklable dictionary mapping the same names to descriptions that
+    attach_arrays turns back into arrays inside a worker.
+  """
+  blocks, specs = [], {}
+  for name, arr in arrays.items():
+    arr = np.asarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    blocks.append(shm)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    specs[name] = (shm.name, arr.shape, arr.dtype.str)
+  return blocks, specs
+
+
+def attach_arrays(specs):
+  """
+  Map shared memory blocks created by share_arrays into this process.
+
+  Returns a tuple of:
+  - blocks: List of SharedMemory objects; they must stay referenced for as
+    long as the arrays are used.
+  - arrays: Dictionary mapping names to read-only arrays backed by the
+    shared memory.
+  """
+  blocks, arrays = [], {}
+  for name, (shm_name, shape, dtype) in specs.items():
+    shm = shared_memory.SharedMemory(name=shm_name)
+    blocks.append(shm)
+    arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    arr.flags.writeable = False
+    arrays[name] = arr
+  return blocks, arrays
+
+
+def release_arrays(blocks):
+  """ Close and free shared memory blocks created by share_arrays. """
+  for shm in blocks:
+    shm.close()
+    shm.unlink()
+
+
+BLAS_THREAD_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS',
+                    'MKL_NUM_THREADS', 'VECLIB_MAXIMUM_THREADS',
+                    'NUMEXPR_NUM_THREADS')
+
+
+def grid_search(model_factory, param_grid, data, n_jobs=-1, blas_threads=None,
+                **train_kwargs):
+  """
+  Train one model per combination of hyperparameters in a pool of worker
+  processes and yield the results as they finish.
+
+  The training and validation arrays are copied into shared memory once and
+  mapped by every worker. Workers are started fresh (spawned) with the BLAS
+  thread count pinned through the usual environment variables, so that
+  n_jobs workers do not each start a full size BLAS thread pool.
+
+  Inputs:
+  - model_factory: Picklable callable returning a new untrained model with
+    train and predict methods, e.g. cs231n.classifiers.LinearSVM.
+  - param_grid: Dictionary mapping keyword arguments of model.train to lists
+    of values; every combination is tried.
+  - data: Dictionary with keys 'X_train', 'y_train', 'X_val' and 'y_val'.
+  - n_jobs: Number of worker processes; -1 uses all cores.
+  - blas_threads: BLAS threads per worker; defaults to the number of cores
+    divided by n_jobs.
+  - train_kwargs: Extra keyword arguments passed to every model.train call,
+    e.g. num_iters. The workers only see read-only views of the shared data,
+    so sampler_options with in_place=True is not supported.
+
+  Yields tuples (params, model, train_accuracy, val_accuracy) in the order
+  the configurations finish, where params is a dictionary holding one value
+  per key of param_grid. The caller should exhaust the generator (or close
+  it) so that the pool and the shared memory are released.
+  """
+  if (train_kwargs.get('sampler_options') or {}).get('in_place'):
+    raise ValueError('grid_search shares read-only training data; '
+                     'sampler_options in_place=True is not supported')
+  names = sorted(param_grid)
+  configs = [{}]
+  for name in names:
+    configs = [dict(c, **{name: v}) for c in configs for v in param_grid[name]]
+  n_jobs = min(resolve_n_jobs(n_jobs), len(configs))
+  if blas_threads is None:
+    blas_threads = max(1, (os.cpu_count() or 1) // n_jobs)
+
+  blocks, specs = share_arrays(data)
+  pool = None
+  try:
+    pool = spawn_pool(n_jobs, blas_threads, _init_grid_worker,
+                      (specs, model_factory, train_kwargs))
+    for result in pool.imap_unordered(_train_config, configs):
+      yield result
+  finally:
+    if pool is not None:
+      pool.terminate()
+      pool.join()
+    release_arrays(blocks)
+
+
+def spawn_pool(n_jobs, blas_threads, initializer, initargs):
+  """
+  Start a pool of freshly spawned processes whose BLAS libraries use
+  blas_threads threads each. Spawned workers read the environment when they
+  import numpy, which is the only portable way to size their BLAS thread
+  pools; the environment of this process is restored afterwards.
+  """
+  saved = dict((var, os.environ.get(var)) for var in BLAS_THREAD_VARS)
+  try:
+    for var in BLAS_THREAD_VARS:
+      os.environ[var] = str(blas_threads)
+    ctx = multiprocessing.get_context('spawn')
+    return ctx.Pool(n_jobs, initializer=initializer, initargs=initargs)
+  finally:
+    for var, value in saved.items():
+      if value is None:
+        os.environ.pop(var, None)
+      else:
+        os.environ[var] = value
+
+
+# State of a grid search worker process, set up by _init_grid_worker.
+_grid_worker = {}
+
+
+def _init_grid_worker(specs, model_factory, train_kwargs):
+  blocks, arrays = attach_arrays(specs)
+  _grid_worker['blocks'] = blocks
+  _grid_worker['data'] = arrays
+  _grid_worker['model_factory'] = model_factory
+  _grid_worker['train_kwargs'] = train_kwargs
+
+
+def _train_config(params):
+  data = _grid_worker['data']
+  kwargs = dict(_grid_worker['train_kwargs'], **params)
+  model = _grid_worker['model_factory']()
+  model.train(data['X_train'], data['y_train'], **kwargs)
+  train_acc = np.mean(model.predict(data['X_train']) == data['y_train'])
+  val_acc = np.mean(model.predict(data['X_val']) == data['y_val'])
+  return params, model, train_acc, val_acc
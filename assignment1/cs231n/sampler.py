@@ -0,0 +1,156 @@
+from __future__ import print_function
+
+import threading
+
+import numpy as np
+
+# Bytes of data shuffled together by default, which sets the size of the
+# shuffle buffer (prefetch keeps two of them). This is a few thousand rows of
+# feature vectors, or about 680 rows of float64 CIFAR-10 pixels.
+DEFAULT_BLOCK_BYTES = 16 * 1024 ** 2
+
+
+class MinibatchSampler(object):
+  """
+  Hands out minibatches from a dataset by shuffling it once per epoch and
+  slicing the shuffled data, instead of gathering a random set of rows for
+  every iteration.
+
+  The data is processed in blocks of block_size rows (by default as many
+  rows as fit in DEFAULT_BLOCK_BYTES, or one block holding the whole dataset
+  with block_size=None). Every epoch visits the blocks in a random order and
+  shuffles the rows of each block with one gather; the minibatches are then
+  contiguous views of the shuffled block. With smaller blocks the shuffle
+  only needs a block sized buffer, at the price of rows never moving between
+  blocks, which is fine for data that is already in random order such as
+  CIFAR-10.
+
+  The shuffled block either goes to a separate buffer or, with in_place,
+  overwrites the block of X and y itself (the caller's arrays are reordered).
+  With prefetch, the next block is shuffled by a background thread while the
+  current one is being consumed.
+
+  Batches are views that are only valid until the next call to next_batch
+  after which their block may be reused.
+  """
+
+  def __init__(self, X, y, batch_size, block_size='auto', in_place=False,
+               prefetch=False, seed=None):
+    """
+    Inputs:
+    - X: A numpy array of shape (N, D) of training data.
+    - y: A numpy array of shape (N,) of training labels.
+    - batch_size: Number of rows per minibatch. The last minibatch of a block
+      may be smaller.
+    - block_size: Number of rows shuffled together; None for the whole
+      dataset. Must not be smaller than batch_size. 'auto' picks the rows
+      that fit in DEFAULT_BLOCK_BYTES, but at least batch_size.
+    - in_place: Shuffle the blocks of X and y in place instead of into a
+      separate buffer.
+    - prefetch: Shuffle the next block in a background thread.
+    - seed: Seed for the shuffling. If None, a seed is drawn from
+      np.random, so np.random.seed makes the shuffling reproducible.
+    """
+    num_train = X.shape[0]
+    if block_size == 'auto':
+      row_bytes = X[:1].nbytes + y.itemsize
+      block_size = max(batch_size, DEFAULT_BLOCK_BYTES // max(row_bytes, 1))
+    if block_size is None or block_size > num_train:
+      block_size = num_train
+    if block_size < min(batch_size, num_train):
+      raise ValueError('block_size must not be smaller than batch_size')
+    if prefetch and in_place and block_size == num_train:
+      raise ValueError('prefetch with in_place needs more than one block')
+    self.X = X
+    self.y = y
+    self.batch_size = batch_size
+    self.block_size = block_size
+    self.in_place = in_place
+    self.prefetch = prefetch
+    if seed is None:
+      seed = np.random.randint(2 ** 31)
+    self.rng = np.random.RandomState(seed)
+    # Number of epochs started so far (prefetching may start one early).
+    self.epoch = 0
+
+    self._starts = []
+    self._buffers = []
+    if not in_place:
+      for _ in range(2 if prefetch else 1):
+        self._buffers.append((np.empty((block_size,) + X.shape[1:], X.dtype),
+                              np.empty(block_size, y.dtype)))
+    self._buffer = 0
+    self._block = None
+    self._pos = 0
+    self._pending = None
+
+  def next_batch(self):
+    """
+    Returns a tuple (X_batch, y_batch) of views of the next minibatch.
+    """
+    if self._block is None or self._pos >= self._block[1].shape[0]:
+      self._block = self._next_block()
+      self._pos = 0
+    lo, hi = self._pos, self._pos + self.batch_size
+    self._pos = hi
+    return self._block[0][lo:hi], self._block[1][lo:hi]
+
+  @property
+  def batches_per_epoch(self):
+    """
+    Number of minibatches next_batch hands out per epoch.
+    """
+    full_blocks, rest = divmod(self.X.shape[0], self.block_size)
+    per_block = -(-self.block_size // self.batch_size)
+    return full_blocks * per_block - (-rest // self.batch_size)
+
+  def _next_start(self):
+    if not self._starts:
+      self._starts = self.rng.permutation(
+          np.arange(0, self.X.shape[0], self.block_size)).tolist()
+      self.epoch += 1
+    return self._starts.pop()
+
+  def _next_block(self):
+    if self._pending is not None:
+      thread, start, result = self._pending
+      thread.join()
+      self._pending = None
+      block = result[0]
+    else:
+      start = self._next_start()
+      block = self._shuffle_block(start, self._block_perm(start),
+                                  self._buffer)
+    self._buffer = (self._buffer + 1) % max(len(self._buffers), 1)
+
+    if self.prefetch:
+      next_start = self._next_start()
+      if self.in_place and next_start == start:
+        # The same block again (a new epoch began with it); it cannot be
+        # shuffled while its rows are still being handed out.
+        self._starts.append(next_start)
+      else:
+        # The permutation is drawn here so that only this thread uses rng.
+        perm, buffer, result = self._block_perm(next_start), self._buffer, []
+        thread = threading.Thread(
+            target=lambda: result.append(
+                self._shuffle_block(next_start, perm, buffer)))
+        thread.start()
+        self._pending = (thread, next_start, result)
+    return block
+
+  def _block_perm(self, start):
+    return self.rng.permutation(min(self.block_size, self.X.shape[0] - start))
+
+  def _shuffle_block(self, start, perm, buffer):
+    stop = start + perm.shape[0]
+    X_block, y_block = self.X[start:stop], self.y[start:stop]
+    if self.in_place:
+      X_block[...] = X_block[perm]
+      y_block[...] = y_block[perm]
+      return X_block, y_block
+    X_buf, y_buf = self._buffers[buffer]
+    X_out, y_out = X_buf[:stop - start], y_buf[:stop - start]
+    np.take(X_block, perm, axis=0, out=X_out)
+    np.take(y_block, perm, axis=0, out=y_out)
+    return X_out, y_out
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmarks for the search backends of cs231n.classifiers.KNearestNeighbor.
+#
+# Run from the assignment1 directory:
+#
+#   python knn_benchmark.py
+#
+# Every benchmark prints a small table; timings are wall clock seconds.
+
+from __future__ import print_function
+import os
+
+import numpy as np
+from cs231n.bench_utils import (cifar_features, clustered_data, load_cifar10,
+                                timeit)
+from cs231n.classifiers import KNearestNeighbor
+
+
+def cifar_data(num_train=20000, num_test=500):
+  """
+  CIFAR-10 pixel vectors and HOG + color histogram features, or None when the
+  dataset has not been downloaded to cs231n/datasets.
+  """
+  cifar = load_cifar10()
+  if cifar is None:
+    return None
+  X_train, y_train, X_test, y_test = cifar
+  X_train, y_train = X_train[:num_train], y_train[:num_train]
+  X_test, y_test = X_test[:num_test], y_test[:num_test]
+  F_train, F_test = cifar_features(X_train, X_test, nbin=25)
+  return {
+    'pixels': (X_train.reshape(num_train, -1), y_train,
+               X_test.reshape(num_test, -1), y_test),
+    'features': (F_train, y_train, F_test, y_test),
+  }
+
+
+def benchmark_tree(dims=(2, 8, 16, 32, 64, 144), sizes=(5000, 20000, 49000),
+                   num_test=500, k=5):
+  """
+  Compare exact tree search against the blocked brute force scan over the
+  feature dimension and the size of the training set.
+  """
+  print('tree index vs brute force (k=%d, %d queries)' % (k, num_test))
+  print('%6s %8s %6s %10s %10s %10s %8s' % (
+      'dim', 'N', 'kind', 'build', 'tree', 'brute', 'speedup'))
+  for dim in dims:
+    for num_train in sizes:
+      X, y = clustered_data(num_train + num_test, dim)
+      knn = KNearestNeighbor()
+      knn.train(X[num_test:], y[num_test:])
+      _, t_build = timeit(knn.build_index, 'tree')
+      y_tree, t_tree = timeit(knn.predict, X[:num_test], k=k, index='tree')
+      y_brute, t_brute = timeit(knn.predict, X[:num_test], k=k)
+      assert np.all(y_tree == y_brute)
+      kind = type(knn.indexes['tree']).__name__.replace('Tree', '').lower()
+      print('%6d %8d %6s %10.3f %10.3f %10.3f %8.2f' % (
+          dim, num_train, kind, t_build, t_tree, t_brute, t_brute / t_tree))
+
+
+def benchmark_lsh(datasets, k=5,
+                  settings=((4, 8), (8, 12), (16, 12), (16, 16), (32, 16))):
+  """
+  Recall / speed trade-off of the LSH index against the exact blocked scan.
+  Recall is the fraction of the exact k nearest neighbors that LSH returns.
+
+  Inputs:
+  - datasets: Dictionary mapping a name to (X_train, y_train, X_test, y_test).
+  - settings: Sequence of (num_tables, num_bits) pairs to try.
+  """
+  print('LSH vs exact search (k=%d)' % k)
+  print('%10s %7s %5s %8s %10s %8s %8s %8s' % (
+      'data', 'tables', 'bits', 'recall', 'cands', 'time', 'speedup', 'acc'))
+  for name in sorted(datasets):
+    X_train, y_train, X_test, y_test = datasets[name]
+    knn = KNearestNeighbor()
+    knn.train(X_train, y_train)
+    (_, exact), t_exact = timeit(knn.query_topk, X_test, k=k)
+    acc = np.mean(knn.vote_labels(y_train[exact]) == y_test)
+    print('%10s %7s %5s %8.3f %10d %8.3f %8.2f %8.3f' % (
+        name, '-', '-', 1.0, X_train.shape[0], t_exact, 1.0, acc))
+    for num_tables, num_bits in settings:
+      knn.build_index('lsh', num_tables=num_tables, num_bits=num_bits)
+      lsh = knn.indexes['lsh']
+      (_, approx), t_lsh = timeit(lsh.query, X_test, k=k)
+      recall = np.mean([np.intersect1d(a, e).shape[0] / float(k)
+                        for a, e in zip(approx, exact)])
+      acc = np.mean(knn.vote_labels(y_train[approx]) == y_test)
+      print('%10s %7d %5d %8.3f %10.0f %8.3f %8.2f %8.3f' % (
+          name, num_tables, num_bits, recall, lsh.mean_candidates, t_lsh,
+          t_exact / t_lsh, acc))
+
+
+def benchmark_hnsw(X_train, X_test, k=5, M=16, ef_construction=100,
+                   ef_searches=(10, 20, 50, 100), path='hnsw_graph.npz'):
+  """
+  Per query latency and recall of the HNSW graph against a one query at a
+  time exact scan, the way an online lookup would run. The graph is saved to
+  path after the first build and loaded from there on later runs.
+  """
+  knn = KNearestNeighbor()
+  knn.train(X_train, np.zeros(X_train.shape[0], dtype=np.int64))
+  if os.path.isfile(path):
+    _, t_build = timeit(knn.load_index, 'hnsw', path)
+    print('HNSW graph loaded from %s in %.3fs' % (path, t_build))
+  else:
+    _, t_build = timeit(knn.build_index, 'hnsw', M=M,
+                        ef_construction=ef_construction)
+    knn.save_index('hnsw', path)
+    print('HNSW graph over %d points built in %.1fs' % (
+        X_train.shape[0], t_build))
+  num_test = X_test.shape[0]
+  exact, t_exact = timeit(
+      lambda: [knn.query_topk(X_test[i:i + 1], k=k)[1][0]
+               for i in range(num_test)])
+  print('%8s %8s %12s' % ('ef', 'recall', 'ms / query'))
+  print('%8s %8.3f %12.3f' % ('exact', 1.0, 1000 * t_exact / num_test))
+  for ef in ef_searches:
+    (_, approx), t = timeit(knn.indexes['hnsw'].query, X_test, k=k, ef=ef)
+    recall = np.mean([np.intersect1d(a, e).shape[0] / float(k)
+                      for a, e in zip(approx, exact)])
+    print('%8d %8.3f %12.3f' % (ef, recall, 1000 * t / num_test))
+
+
+def benchmark_pq(datasets, k=5, settings=((8, 0), (16, 0), (32, 0), (32, 100))):
+  """
+  Index size and accuracy of product quantization against the raw float64
+  training matrix.
+
+  Inputs:
+  - datasets: Dictionary mapping a name to (X_train, y_train, X_test, y_test).
+  - settings: Sequence of (num_subspaces, rerank) pairs to try.
+  """
+  print('product quantization vs raw data (k=%d)' % k)
+  print('%10s %6s %7s %12s %9s %8s %8s %8s' % (
+      'data', 'bytes', 'rerank', 'index size', 'ratio', 'build', 'query',
+      'acc'))
+  for name in sorted(datasets):
+    X_train, y_train, X_test, y_test = datasets[name]
+    knn = KNearestNeighbor()
+    knn.train(X_train, y_train)
+    y_pred, t_exact = timeit(knn.predict, X_test, k=k)
+    print('%10s %6d %7s %12d %9.1f %8s %8.3f %8.3f' % (
+        name, X_train.shape[1] * X_train.itemsize, '-', X_train.nbytes, 1.0,
+        '-', t_exact, np.mean(y_pred == y_test)))
+    for num_subspaces, rerank in settings:
+      _, t_build = timeit(knn.build_index, 'pq', num_subspaces=num_subspaces,
+                          rerank=rerank)
+      pq = knn.indexes['pq']
+      y_pred, t_pq = timeit(knn.predict, X_test, k=k, index='pq')
+      print('%10s %6d %7d %12d %9.1f %8.2f %8.3f %8.3f' % (
+          name, num_subspaces, rerank, pq.nbytes, X_train.nbytes /
+          float(pq.nbytes), t_build, t_pq, np.mean(y_pred == y_test)))
+
+
+def benchmark_condense(datasets, k=1, tolerance=0.01,
+                       methods=('kmeans', 'cnn', 'enn')):
+  """
+  Reduction ratio, validation accuracy and predict speedup of the prototype
+  condensation methods of KNearestNeighbor.condense.
+  """
+  print('prototype condensation (k=%d, tolerance %.3f)' % (k, tolerance))
+  print('%10s %8s %8s %8s %8s %8s %8s %8s' % (
+      'data', 'method', 'kept', 'ratio', 'acc', 'acc new', 'speedup',
+      'applied'))
+  for name in sorted(datasets):
+    X_train, y_train, X_test, y_test = datasets[name]
+    for method in methods:
+      knn = KNearestNeighbor()
+      knn.train(X_train, y_train)
+      r = knn.condense(X_test, y_test, method=method, k=k, tolerance=tolerance)
+      print('%10s %8s %8d %8.1f %8.3f %8.3f %8.2f %8s' % (
+          name, method, r['num_after'], r['ratio'], r['acc_before'],
+          r['acc_after'], r['speedup'], r['applied']))
+
+
+if __name__ == '__main__':
+  benchmark_tree()
+
+  datasets = cifar_data()
+  if datasets is None:
+    print('CIFAR-10 not found, using synthetic data')
+    X, y = clustered_data(20500, 3072)
+    F, y_F = clustered_data(20500, 169)
+    datasets = {
+      'pixels': (X[500:], y[500:], X[:500], y[:500]),
+      'features': (F[500:], y_F[500:], F[:500], y_F[:500]),
+    }
+  benchmark_lsh(datasets)
+  benchmark_pq(datasets)
+  benchmark_condense(datasets)
+
+  X_train, _, X_test, _ = datasets['features']
+  benchmark_hnsw(X_train, X_test)
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Benchmarks for the solvers of cs231n.classifiers.LinearClassifier.
+#
+# Run from the assignment1 directory:
+#
+#   python linear_benchmark.py
+#
+# Every benchmark prints a small table; timings are wall clock seconds.
+
+from __future__ import print_function
+
+import numpy as np
+from cs231n.bench_utils import (add_bias, cifar_features, clustered_data,
+                                load_cifar10, timeit)
+from cs231n.classifiers import LinearSVM, Softmax
+
+
+def cifar_data(num_train=49000, num_val=1000):
+  """
+  Mean subtracted CIFAR-10 pixels and normalized HOG + color histogram
+  features, both with a bias column, or None when the dataset has not been
+  downloaded to cs231n/datasets.
+  """
+  cifar = load_cifar10()
+  if cifar is None:
+    return None
+  X_train, y_train, _, _ = cifar
+  X_val, y_val = X_train[num_train:num_train + num_val], y_train[
+      num_train:num_train + num_val]
+  X_train, y_train = X_train[:num_train], y_train[:num_train]
+
+  P_train = X_train.reshape(num_train, -1)
+  P_val = X_val.reshape(num_val, -1)
+  mean_image = P_train.mean(axis=0)
+  F_train, F_val = cifar_features(X_train, X_val, nbin=10)
+  return {
+    'pixels': (add_bias(P_train - mean_image), y_train,
+               add_bias(P_val - mean_image), y_val),
+    'features': (add_bias(F_train), y_train, add_bias(F_val), y_val),
+  }
+
+
+def benchmark_solvers(datasets, settings, epochs=(1, 2, 4, 8, 16),
+                      solvers=('sgd', 'asgd', 'svrg'), batch_size=200,
+                      classifiers=(LinearSVM, Softmax), target_gap=0.01):
+  """
+  Training loss, validation loss and validation accuracy of the minibatch
+  solvers after a number of epochs of minibatch steps. The passes column
+  counts every pass over the training data, including the full gradients of
+  SVRG.
+
+  The reference loss is the lowest training loss reached by any run,
+  including a long L-BFGS run (which minimizes the smoothed loss for the
+  SVM); the last line gives the passes each solver needs to get within
+  target_gap (relative) of it.
+
+  Inputs:
+  - datasets: Dictionary mapping a name to (X_train, y_train, X_val, y_val).
+  - settings: Dictionary mapping a dataset name to the (learning_rate, reg)
+    used by every solver on it.
+  """
+  for name in sorted(datasets):
+    X_train, y_train, X_val, y_val = datasets[name]
+    learning_rate, reg = settings[name]
+    num_train = X_train.shape[0]
+    epoch_iters = -(-num_train // batch_size)
+    for cls in classifiers:
+      rows = []
+
+      def run(solver, num_epochs, **kwargs):
+        np.random.seed(0)
+        model = cls()
+        _, t = timeit(model.train, X_train, y_train, reg=reg, solver=solver,
+                      **kwargs)
+        train_loss, _ = model.full_batch_loss(X_train, y_train, reg)
+        val_loss, _ = model.full_batch_loss(X_val, y_val, reg)
+        val_acc = np.mean(model.predict(X_val) == y_val)
+        if solver == 'lbfgs':
+          passes = '-'
+        else:
+          passes = num_epochs * (2 if solver == 'svrg' else 1)
+        rows.append((solver, num_epochs, passes, train_loss, val_loss,
+                     val_acc, t))
+
+      run('lbfgs', '-', num_iters=1000)
+      for solver in solvers:
+        for num_epochs in epochs:
+          run(solver, num_epochs, learning_rate=learning_rate,
+              num_iters=num_epochs * epoch_iters, batch_size=batch_size,
+              sampler_options={'seed': 0})
+
+      print('%s on %s (learning rate %g, reg %g)' % (
+          cls.__name__, name, learning_rate, reg))
+      print('%6s %7s %7s %10s %10s %8s %8s' % (
+          'solver', 'epochs', 'passes', 'train loss', 'val loss', 'val acc',
+          'time'))
+      for row in rows:
+        print('%6s %7s %7s %10.4f %10.4f %8.3f %8.2f' % row)
+      target = min(row[3] for row in rows) * (1 + target_gap)
+      print('passes to reach train loss %.4f:' % target, ', '.join(
+          '%s %s' % (solver, next((row[2] for row in rows
+                                   if row[0] == solver and row[3] <= target),
+                                  '-'))
+          for solver in solvers))
+      print()
+
+
+def benchmark_dcd(X_train, y_train, X_val, y_val, reg, learning_rate,
+                  passes=(1, 2, 5, 10, 20, 50), batch_size=200):
+  """
+  Dual coordinate descent against SGD for LinearSVM, by passes over the
+  training data. The dcd rows give the one-vs-rest objective it minimizes,
+  the sgd rows the multiclass SVM loss, so compare their accuracies rather
+  than their losses across solvers.
+  """
+  epoch_iters = -(-X_train.shape[0] // batch_size)
+  print('LinearSVM dcd vs sgd (reg %g, sgd learning rate %g)' % (
+      reg, learning_rate))
+  print('%6s %7s %10s %8s %8s' % ('solver', 'passes', 'loss', 'val acc',
+                                  'time'))
+  for num_passes in passes:
+    for solver in ('dcd', 'sgd'):
+      np.random.seed(0)
+      model = LinearSVM()
+      loss_history, t = timeit(
+          model.train, X_train, y_train, learning_rate=learning_rate, reg=reg,
+          num_iters=num_passes * (1 if solver == 'dcd' else epoch_iters),
+          batch_size=batch_size, solver=solver, sampler_options={'seed': 0})
+      if solver == 'dcd':
+        loss = loss_history[-1]
+      else:
+        loss, _ = model.full_batch_loss(X_train, y_train, reg)
+      print('%6s %7d %10.4f %8.3f %8.2f' % (
+          solver, num_passes, loss, np.mean(model.predict(X_val) == y_val), t))
+
+
+if __name__ == '__main__':
+  datasets = cifar_data()
+  if datasets is None:
+    print('CIFAR-10 not found, using synthetic data')
+    X, y = clustered_data(11000, 3072, spread=0.05, bias=True)
+    F, y_F = clustered_data(11000, 154, spread=0.3, bias=True, seed=1)
+    datasets = {
+      'pixels': (X[1000:], y[1000:], X[:1000], y[:1000]),
+      'features': (F[1000:], y_F[1000:], F[:1000], y_F[:1000]),
+    }
+    settings = {'pixels': (1e-3, 1e-2), 'features': (1e-2, 1e-2)}
+  else:
+    settings = {'pixels': (1e-7, 2.5e4), 'features': (1e-2, 1e-3)}
+  benchmark_solvers(datasets, settings)
+
+  X_train, y_train, X_val, y_val = datasets['features']
+  learning_rate, reg = settings['features']
+  benchmark_dcd(X_train, y_train, X_val, y_val, reg, learning_rate)
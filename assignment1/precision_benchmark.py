@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# Accuracy parity and speed of float32 against float64 training for the
+# linear classifiers and TwoLayerNet.
+#
+# Run from the assignment1 directory:
+#
+#   python precision_benchmark.py
+#
+# Every benchmark prints a small table; timings are wall clock seconds.
+
+from __future__ import print_function
+
+import numpy as np
+from cs231n.bench_utils import clustered_data, load_cifar10, timeit
+from cs231n.classifiers import LinearSVM, Softmax
+from cs231n.classifiers.neural_net import TwoLayerNet
+
+
+def cifar_data(dtype, num_train=49000, num_val=1000):
+  """
+  Mean subtracted CIFAR-10 pixels of the given datatype, flattened to rows,
+  or None when the dataset has not been downloaded to cs231n/datasets.
+  """
+  cifar = load_cifar10(dtype)
+  if cifar is None:
+    return None
+  X_train, y_train, _, _ = cifar
+  X_train = X_train.reshape(X_train.shape[0], -1)
+  X_val = X_train[num_train:num_train + num_val]
+  y_val = y_train[num_train:num_train + num_val]
+  X_train, y_train = X_train[:num_train], y_train[:num_train]
+  mean_image = X_train.mean(axis=0)
+  return X_train - mean_image, y_train, X_val - mean_image, y_val
+
+
+def benchmark_precision(data, num_iters=1500, batch_size=200, seed=0):
+  """
+  Train every model once in float64 and once in float32 from the same
+  initialization and minibatches, and compare final loss, validation
+  accuracy, training time and the memory of weights plus training data.
+
+  Inputs:
+  - data: Dictionary mapping np.float64 and np.float32 to the tuple
+    (X_train, y_train, X_val, y_val) of that datatype.
+  """
+  dim = data[np.float64][0].shape[1]
+  models = [
+    ('LinearSVM', lambda dtype: LinearSVM(dtype=dtype),
+     dict(learning_rate=1e-7, reg=2.5e4)),
+    ('Softmax', lambda dtype: Softmax(dtype=dtype),
+     dict(learning_rate=1e-7, reg=2.5e4)),
+    ('TwoLayerNet', lambda dtype: TwoLayerNet(dim, 50, 10, buffered=True,
+                                             dtype=dtype),
+     dict(learning_rate=1e-4, reg=0.25)),
+  ]
+  print('float32 vs float64 (%d iterations of %d)' % (num_iters, batch_size))
+  print('%12s %8s %10s %8s %8s %10s' % (
+      'model', 'dtype', 'loss', 'val acc', 'time', 'MB'))
+  for name, make_model, kwargs in models:
+    for dtype in (np.float64, np.float32):
+      X_train, y_train, X_val, y_val = data[dtype]
+      np.random.seed(seed)
+      model = make_model(dtype)
+      options = dict(num_iters=num_iters, batch_size=batch_size,
+                     sampler_options={'seed': seed}, **kwargs)
+      if isinstance(model, TwoLayerNet):
+        stats, t = timeit(model.train, X_train, y_train, X_val, y_val,
+                          **options)
+        loss_history = stats['loss_history']
+        weight_bytes = sum(p.nbytes for p in model.params.values())
+      else:
+        loss_history, t = timeit(model.train, X_train, y_train, **options)
+        weight_bytes = model.W.nbytes
+      val_acc = np.mean(model.predict(X_val) == y_val)
+      print('%12s %8s %10.4f %8.3f %8.2f %10.1f' % (
+          name, np.dtype(dtype).name, np.mean(loss_history[-100:]), val_acc,
+          t, (weight_bytes + X_train.nbytes) / 1024.0 ** 2))
+
+
+if __name__ == '__main__':
+  data = dict((dtype, cifar_data(dtype)) for dtype in (np.float64, np.float32))
+  if data[np.float64] is None:
+    print('CIFAR-10 not found, using synthetic data')
+    X, y = clustered_data(11000, 3072, spread=0.05)
+    X *= 64
+    for dtype in (np.float64, np.float32):
+      X_d = X.astype(dtype)
+      data[dtype] = (X_d[1000:], y[1000:], X_d[:1000], y[:1000])
+  benchmark_precision(data)